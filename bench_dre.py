@@ -0,0 +1,269 @@
+"""
+Benchmark das etapas da DRE com dados sintéticos no schema real.
+
+    python bench_dre.py                                   # escalas padrão
+    python bench_dre.py --escala 10000:50 5000000:5000 --repeticoes 5
+    python bench_dre.py --saida bench.jsonl               # acrescenta ao histórico
+
+Gera bases BD/BD CONT sintéticas (EMPRESA, MÊS REF e todas as colunas de
+custo), mede leitura (planilha e cache Parquet), filtros cliente/período,
+compute_totals/cubo, agregação e ranking do Dashboard, formatação e render
+(Top-N e DRE em HTML) e o Orçado x Realizado, e escreve uma linha JSON por etapa – formato estável para
+acompanhar regressões ao longo do tempo.
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from dre_batch import load_budget_data, load_dataset
+from dre_core import (BD_PLAN_KEY, bd_dtypes, bd_usecols, budget_comparison, budget_variance, build_budget,
+                      build_dre_cube, build_row_index, canonicalize_bd, compact_bd, compute_totals, dre_statement,
+                      frame_memory, group_lines, money_series, perc_series, rank_clients, resolve_real_cols,
+                      resolve_schema, statement_table_html)
+from dre_io import cached_parquet, normalize_frame
+
+DEFAULT_SCALES = ["10000:50", "100000:500", "1000000:2000"]
+# Acima disso a etapa de leitura da planilha fica de fora (gerar o .xlsx leva minutos); a do Parquet continua
+MAX_XLSX_ROWS = 200_000
+
+# Colunas do BD.xlsx real, na mesma ordem
+BD_COLUMNS = [
+    "EMPRESA", "CONTRATO $", "FAT MÊS $", "PREV x REAL", "DEDUÇÕES LEGAIS", "RECEITA LIQUIDA", "FOPAG TOTAL",
+    "FOPAG S/ ROL", "RESULTADO BRUTO LIQUIDO", "RB %", "SALÁRIO", "VALE TRANSPORTE ", "VALE ALIMENTAÇÃO",
+    "VALE REFEIÇÃO", "ASSIDUIDADE", "TOTAL BENEFÍCIOS", "FGTS", "INSS", "TOTAL ENCARGOS", "TOTAL GERAL",
+    "RATEIO MP", "MARGEM DE CONTRIBUIÇÃO (R$)", "MARGEM DE CONTRIBUIÇÃO (%)", "MÊS / ANO", "MÊS REF",
+    "VALOR DA MP NO MÊS", "FT", "FREELANCE",
+]
+
+# -----------------------------
+# Dados sintéticos
+# -----------------------------
+def make_bd_frame(rows: int, clients: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Base no schema do BD.xlsx: `rows` linhas espalhadas por `clients`
+    clientes e tantos meses quantos couberem (uma linha por cliente/mês,
+    repetindo o cliente quando rows > clients × meses).
+    """
+    rng = np.random.default_rng(seed)
+    months = max(1, rows // clients)
+    month_idx = np.arange(rows) // clients % months
+    emp = np.array([f"CLIENTE {i:05d}" for i in range(clients)], dtype=object)[np.arange(rows) % clients]
+    meses = pd.period_range("2020-01", periods=months, freq="M").to_timestamp(how="end").normalize()
+    mes_ref = meses[month_idx]
+
+    fat = np.round(rng.lognormal(10, 1, rows), 2)
+    sal = np.round(fat * rng.uniform(0.2, 0.4, rows), 2)
+    vt, va, vr = (np.round(fat * rng.uniform(0, 0.06, rows), 2) for _ in range(3))
+    ass = np.round(rng.choice([0, 300, 600, 1200], rows).astype(float), 2)
+    fgts, inss = np.round(sal * 0.08, 2), np.round(sal * 0.2, 2)
+    enc = fgts + inss
+    ded = np.round(fat * 0.165, 2)
+    rateio = fat * rng.uniform(0.02, 0.05, rows)
+    ft = np.where(rng.random(rows) < 0.2, np.round(rng.uniform(100, 2000, rows), 2), 0.0)
+    frl = np.where(rng.random(rows) < 0.1, np.round(rng.uniform(100, 2000, rows), 2), 0.0)
+    beneficios = vt + va + vr + ass
+    fopag = sal + beneficios + enc
+    mc = fat - ded - fopag - rateio - ft - frl
+    # Buracos como na planilha real
+    vt[rng.random(rows) < 0.05] = np.nan
+
+    return pd.DataFrame({
+        "EMPRESA": emp, "CONTRATO $": fat, "FAT MÊS $": fat, "PREV x REAL": 1.0, "DEDUÇÕES LEGAIS": ded,
+        "RECEITA LIQUIDA": fat - ded, "FOPAG TOTAL": fopag, "FOPAG S/ ROL": fopag / (fat - ded),
+        "RESULTADO BRUTO LIQUIDO": fat - ded - fopag, "RB %": (fat - ded - fopag) / (fat - ded),
+        "SALÁRIO": sal, "VALE TRANSPORTE ": vt, "VALE ALIMENTAÇÃO": va, "VALE REFEIÇÃO": vr, "ASSIDUIDADE": ass,
+        "TOTAL BENEFÍCIOS": beneficios, "FGTS": fgts, "INSS": inss, "TOTAL ENCARGOS": enc, "TOTAL GERAL": fopag,
+        "RATEIO MP": rateio, "MARGEM DE CONTRIBUIÇÃO (R$)": mc, "MARGEM DE CONTRIBUIÇÃO (%)": mc / fat,
+        "MÊS / ANO": mes_ref.to_period("M").to_timestamp(), "MÊS REF": mes_ref, "VALOR DA MP NO MÊS": np.nan,
+        "FT": ft, "FREELANCE": frl,
+    }, columns=BD_COLUMNS)
+
+def make_budget_frame(clients: int, seed: int = 0) -> pd.DataFrame:
+    """Base no schema da aba BD CONT (uma linha por cliente)."""
+    rng = np.random.default_rng(seed + 1)
+    fat = np.round(rng.lognormal(10, 1, clients), 2)
+    return pd.DataFrame({
+        "Cliente": [f"CLIENTE {i:05d}" for i in range(clients)],
+        "(-) DEDUÇÕES LEGAIS": np.round(fat * 0.165, 2),
+        "(-) SALÁRIO": np.round(fat * 0.3, 2),
+        "(-) VALE TRANSPORTE ": np.round(fat * 0.04, 2),
+        "(-) VALE ALIMENTAÇÃO": np.round(fat * 0.02, 2),
+        "(-) VALE REFEIÇÃO": np.round(fat * 0.05, 2),
+        "(-) ASSIDUIDADE": np.round(fat * 0.02, 2),
+        "(+) FATURAMENTO BRUTO": fat,
+        "(-) MATERIAL DE CONSUMO": np.round(fat * 0.02, 2),
+        "(-) TOTAL ENCARGOS": np.round(fat * 0.17, 2),
+    })
+
+def write_workbook(df: pd.DataFrame, path, sheet: str):
+    """Grava em modo write-only do openpyxl (bem mais rápido que to_excel para bases grandes)."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(sheet)
+    ws.append(list(df.columns))
+    cols = [df[c].to_numpy(dtype=object) for c in df.columns]
+    for i in range(len(df)):
+        ws.append([None if isinstance(v, float) and v != v else v for v in (c[i] for c in cols)])
+    wb.save(path)
+
+# -----------------------------
+# Medição
+# -----------------------------
+def timeit(fn, repeats: int):
+    times, result = [], None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return {"best_s": min(times), "median_s": statistics.median(times), "repeats": repeats}, result
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=Path(__file__).parent, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+def bench_scale(rows: int, clients: int, repeats: int, workdir: Path, seed: int = 0):
+    """Mede todas as etapas numa escala; gera um dict por etapa."""
+    df = make_bd_frame(rows, clients, seed)
+    dfb = make_budget_frame(clients, seed)
+
+    if rows <= MAX_XLSX_ROWS:
+        bd_path = workdir / f"BD_{rows}_{clients}.xlsx"
+        bud_path = workdir / f"BD_CONT_{clients}.xlsx"
+        write_workbook(df, bd_path, "BD")
+        write_workbook(dfb, bud_path, "BD CONT")
+        # Frio: planilha -> Parquet (cache removido a cada repetição); quente: só Parquet
+        cache_dir = bd_path.parent / ".dre_cache"
+        def cold():
+            for f in cache_dir.glob(f"{bd_path.name}.*"):
+                f.unlink()
+            return load_dataset(bd_path)
+        stats, loaded = timeit(cold, repeats)
+        yield "load_data.xlsx", stats
+        stats, loaded = timeit(lambda: load_dataset(bd_path), repeats)
+        yield "load_data.parquet", stats
+        # A primeira leitura do orçamento grava o cache: fica fora da medição, que é só do Parquet
+        load_budget_data(bud_path)
+        stats, budget = timeit(lambda: load_budget_data(bud_path), repeats)
+        yield "load_budget.parquet", stats
+        df = loaded
+        parquet_path, _ = cached_parquet(bd_path, "bd", usecols=bd_usecols, dtypes=bd_dtypes, plan_key=BD_PLAN_KEY)
+    else:
+        yield "load_data.xlsx", {"skipped": f"rows > {MAX_XLSX_ROWS}"}
+        # Sem planilha, a base vai para um Parquet igual ao cache (colunas da DRE, MÊS REF e PERIODO_LABEL)
+        # e a etapa mede o que load_data faz com o cache quente: leitura do Parquet + compactação
+        df.columns = [c.strip() for c in df.columns]
+        parquet_path = workdir / f"BD_{rows}_{clients}.parquet"
+        normalize_frame(df[bd_usecols(list(df.columns))]).to_parquet(parquet_path, index=False)
+        stats, df = timeit(lambda: compact_bd(canonicalize_bd(pd.read_parquet(parquet_path))), repeats)
+        yield "load_data.parquet", stats
+        budget = build_budget(dfb, "BD CONT")
+
+    # Memória: base como sai da leitura x a representação compacta que load_data entrega ao app
+    yield "memory.compact", {"bytes_before": frame_memory(canonicalize_bd(pd.read_parquet(parquet_path))),
+                             "bytes_after": frame_memory(df)}
+
+    schema = resolve_schema(df)
+    periodo = df["MÊS REF"].max()
+    cliente = df["EMPRESA"].iloc[0]
+
+    # Filtros: máscara sobre a tabela inteira (como antes) x índice de linhas
+    stats, _ = timeit(lambda: df[(df["EMPRESA"].astype(str) == str(cliente)) & (df["MÊS REF"] == periodo)], repeats)
+    yield "filter.mask", stats
+    stats, row_index = timeit(lambda: build_row_index(df, schema), repeats)
+    yield "filter.index_build", stats
+    stats, _ = timeit(lambda: row_index.client_period_rows(df, cliente, periodo), repeats)
+    yield "filter.index_lookup", stats
+
+    # compute_totals sobre o recorte x cubo (construção + consulta)
+    dff = row_index.period_rows(df, periodo)
+    stats, _ = timeit(lambda: compute_totals(dff, schema), repeats)
+    yield "compute_totals.period", stats
+    stats, cube = timeit(lambda: build_dre_cube(df, schema), repeats)
+    yield "cube.build", stats
+    stats, _ = timeit(lambda: (cube.get(cliente, periodo), cube.total(periodo)), repeats)
+    yield "cube.lookup", stats
+
+    # Dashboard: by_emp do período + Top-N
+    def dashboard():
+        by_emp = cube.period_slice(periodo)
+        return [by_emp.sort_values(c, ascending=False).head(10) for c in ["FAT BRUTO", "CSP", "MC", "MC%"]]
+    stats, _ = timeit(dashboard, repeats)
+    yield "dashboard.by_emp_rank", stats
+    stats, _ = timeit(lambda: rank_clients(cube.by_client), repeats)
+    yield "dashboard.rank_all_periods", stats
+
+    # Formatação e render: o que o app monta a cada execução (Top-N do Dashboard, DRE de um cliente em HTML)
+    # e uma coluna longa (exportação/matriz), que passa pela versão vetorizada
+    top = cube.period_slice(periodo).nlargest(20, "FAT BRUTO")
+    stats, _ = timeit(lambda: (money_series(top["FAT BRUTO"]), perc_series(top["MC%"])), repeats)
+    yield "format.top_n", stats
+    stats, _ = timeit(lambda: money_series(cube.by_client["FAT BRUTO"]), repeats)
+    yield "format.column", stats
+    def statement():
+        stmt = dre_statement(cube.get(cliente, periodo), schema.cost_cols)
+        return statement_table_html("REALIZADO", stmt, money_series(stmt["Valor"]), perc_series(stmt["AV%"]))
+    stats, _ = timeit(statement, repeats)
+    yield "render.statement", stats
+
+    # Orçado x Realizado: um cliente e a carteira inteira
+    real_fat, real_ded, real_costs = resolve_real_cols(df)
+    stats, (real_by_client, _) = timeit(lambda: group_lines(df, schema, real_fat, real_ded, real_costs), repeats)
+    yield "budget.real_lines", stats
+    real = real_by_client.xs(periodo, level=0)
+    orcado = budget.lines()
+    stats, _ = timeit(lambda: budget_comparison(orcado.loc[str(cliente)], real.loc[str(cliente)]), repeats)
+    yield "budget.compare_one", stats
+    stats, _ = timeit(lambda: budget_variance(orcado, real), repeats)
+    yield "budget.variance_all", stats
+
+def parse_scale(text: str):
+    rows, _, clients = text.partition(":")
+    return int(rows), int(clients or 50)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark das etapas da DRE com dados sintéticos.")
+    parser.add_argument("--escala", nargs="+", default=DEFAULT_SCALES,
+                        help="LINHAS:CLIENTES (ex.: 10000:50 5000000:5000)")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--saida", help="arquivo JSON Lines (acrescenta); padrão: stdout")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    meta = {
+        "run_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+    out = open(args.saida, "a", encoding="utf-8") if args.saida else sys.stdout
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench_dre_") as tmp:
+            for scale in args.escala:
+                rows, clients = parse_scale(scale)
+                for stage, stats in bench_scale(rows, clients, args.repeticoes, Path(tmp), args.seed):
+                    record = {**meta, "stage": stage, "rows": rows, "clients": clients, **stats}
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
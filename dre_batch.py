@@ -0,0 +1,213 @@
+"""
+DRE em lote, sem Streamlit: demonstrativos, rankings e Orçado x Realizado
+de todos os clientes em todos os períodos, exportados de uma vez.
+
+    python dre_batch.py --saida export/
+    python dre_batch.py --bd "BD/*.xlsx" --formato parquet csv --periodo 2025-09
+    python dre_batch.py --backend duckdb        # agregação fora da memória (dre_sql)
+    python dre_batch.py --verificar             # confere pandas x DuckDB antes de exportar
+
+As contas são as mesmas do app (dre_core): o cubo agrega todos os
+(período × cliente) numa única passada vetorizada, as planilhas novas ou
+alteradas são lidas em paralelo (dre_io.load_sources) e as tabelas são
+gravadas em paralelo.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from dre_core import (BD_PLAN_KEY, BUDGET_PLAN_KEY, bd_dtypes, bd_usecols, budget_dtypes, budget_variance,
+                      build_budget, build_dre_cube, canonicalize_bd, compact_bd, group_lines, rank_clients, resolve_real_cols,
+                      resolve_schema)
+from dre_io import expand_sources, load_cached, load_sources, month_label
+
+FORMATS = ["xlsx", "parquet", "csv"]
+BACKENDS = ["pandas", "duckdb"]
+
+# -----------------------------
+# Leitura
+# -----------------------------
+def load_dataset(spec, max_workers: int | None = None) -> pd.DataFrame:
+    paths = expand_sources(spec)
+    if not paths:
+        raise FileNotFoundError(f"Nenhuma planilha encontrada em '{spec}'")
+    df, _ = load_sources(paths, preferred_sheet="bd", usecols=bd_usecols, dtypes=bd_dtypes,
+                         plan_key=BD_PLAN_KEY, canonicalize=canonicalize_bd, max_workers=max_workers)
+    return compact_bd(df)
+
+def load_budget_data(path):
+    dfb, sheet = load_cached(path, prefix="BD CONT", dtypes=budget_dtypes, plan_key=BUDGET_PLAN_KEY)
+    return build_budget(dfb, sheet)
+
+# -----------------------------
+# Cálculo
+# -----------------------------
+def _select_periods(index: pd.Index, periodos) -> pd.Index:
+    """Períodos pedidos em --periodo: "AAAA-MM" (MÊS REF) ou o texto exato (TIMES)."""
+    if not periodos:
+        return index
+    if isinstance(index, pd.DatetimeIndex):
+        wanted = {pd.Period(p, freq="M") for p in periodos}
+        return index[[p in wanted for p in index.to_period("M")]]
+    return index[index.isin([str(p) for p in periodos])]
+
+def _with_labels(frame: pd.DataFrame, schema) -> pd.DataFrame:
+    out = frame.reset_index()
+    if schema.has_mes_ref:
+        out.insert(1, "PERIODO_LABEL", [month_label(p) for p in out["PERIODO"]])
+    return out
+
+def compute_tables(df: pd.DataFrame | None, budget=None, periodos=None, backend=None) -> dict[str, pd.DataFrame]:
+    """
+    Todas as tabelas do pacote de fechamento:
+    dre_clientes, dre_consolidado, rankings e (com orçamento) orcado_x_realizado.
+    Com `backend` (dre_sql.SqlBackend) as agregações saem do SQL e `df` não é usado.
+    """
+    if backend is None:
+        schema = resolve_schema(df)
+        cube = build_dre_cube(df, schema)
+    else:
+        cube = backend.build_cube()
+        schema = cube.schema
+    keep = _select_periods(cube.consolidated.index, periodos)
+    by_client = cube.by_client.loc[cube.by_client.index.get_level_values(0).isin(keep)]
+    consolidated = cube.consolidated.loc[keep]
+
+    tables = {
+        "dre_clientes": _with_labels(by_client, schema),
+        "dre_consolidado": _with_labels(consolidated, schema),
+        "rankings": _with_labels(rank_clients(by_client), schema),
+    }
+
+    if budget is not None:
+        # Realizado com as mesmas colunas usadas na tela "Orçado x Realizado"
+        if backend is None:
+            real_by_client, _ = group_lines(df, schema, *resolve_real_cols(df))
+        else:
+            real_by_client = backend.real_lines()
+        orcado = budget.lines()
+        parts = {}
+        for periodo in keep:
+            try:
+                real = real_by_client.xs(periodo, level=0)
+            except KeyError:
+                real = real_by_client.iloc[0:0].droplevel(0)
+            parts[periodo] = budget_variance(orcado, real)
+        if parts:
+            variance = pd.concat(parts, names=["PERIODO"])
+            tables["orcado_x_realizado"] = _with_labels(variance, schema)
+    return tables
+
+def compare_tables(expected: dict, actual: dict) -> list[str]:
+    """
+    Diferenças entre dois conjuntos de tabelas (vazio = idênticos). Colunas
+    em centavos batem exatamente; as somadas em float só diferem pela ordem
+    da soma, daí a tolerância.
+    """
+    problems = [f"{name}: ausente" for name in expected.keys() ^ actual.keys()]
+    # EMPRESA é categórica na base compacta e texto no SQL: compara os valores
+    plain = lambda t: t.astype({c: dt.categories.dtype for c, dt in t.dtypes.items()
+                                   if isinstance(dt, pd.CategoricalDtype)})
+    for name in expected.keys() & actual.keys():
+        try:
+            pd.testing.assert_frame_equal(plain(expected[name]), plain(actual[name]), check_exact=False,
+                                          rtol=1e-9, atol=1e-6, check_index_type=False, check_column_type=False)
+        except AssertionError as exc:
+            problems.append(f"{name}: {str(exc).splitlines()[0]}")
+    return sorted(problems)
+
+# -----------------------------
+# Escrita
+# -----------------------------
+def _write(name: str, table: pd.DataFrame, out_dir: Path, fmt: str) -> Path:
+    path = out_dir / f"{name}.{fmt}"
+    if fmt == "parquet":
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False, sep=";", decimal=",", encoding="utf-8-sig")
+    return path
+
+def _write_xlsx(tables: dict, out_dir: Path) -> Path:
+    path = out_dir / "dre_pacote.xlsx"
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for name, table in tables.items():
+            table.to_excel(writer, sheet_name=name[:31], index=False)
+    return path
+
+def write_tables(tables: dict, out_dir, formats, max_workers: int | None = None) -> list[Path]:
+    """Grava cada tabela em cada formato; os arquivos são escritos em paralelo."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = []
+        if "xlsx" in formats:
+            futures.append(pool.submit(_write_xlsx, tables, out_dir))
+        for fmt in formats:
+            if fmt != "xlsx":
+                futures += [pool.submit(_write, name, table, out_dir, fmt) for name, table in tables.items()]
+        return [f.result() for f in futures]
+
+# -----------------------------
+# CLI
+# -----------------------------
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Exporta a DRE de todos os clientes e períodos, sem Streamlit.")
+    parser.add_argument("--bd", default="BD.xlsx", help="BD.xlsx, diretório ou glob de planilhas (padrão: BD.xlsx)")
+    parser.add_argument("--orcamento", default="BD CONT NOVO.xlsx",
+                        help="planilha de orçamento; use '' para não gerar o Orçado x Realizado")
+    parser.add_argument("--saida", default="export", help="diretório de saída (padrão: export)")
+    parser.add_argument("--formato", nargs="+", choices=FORMATS, default=["xlsx"], help="formatos de saída")
+    parser.add_argument("--periodo", action="append", help="AAAA-MM (MÊS REF) ou texto de TIMES; pode repetir")
+    parser.add_argument("--workers", type=int, default=None, help="processos/threads de leitura e escrita")
+    parser.add_argument("--backend", choices=BACKENDS, default="pandas",
+                        help="motor das agregações: pandas (padrão, base em memória) ou duckdb (Parquet, fora da memória)")
+    parser.add_argument("--verificar", action="store_true",
+                        help="calcula com pandas e DuckDB e falha se as tabelas diferirem")
+    return parser
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    t0 = time.perf_counter()
+    df = backend = None
+    if args.backend == "duckdb" or args.verificar:
+        from dre_sql import SqlBackend
+        paths = expand_sources(args.bd)
+        if not paths:
+            raise FileNotFoundError(f"Nenhuma planilha encontrada em '{args.bd}'")
+        backend = SqlBackend(paths, threads=args.workers)
+    if args.backend == "pandas" or args.verificar:
+        df = load_dataset(args.bd, max_workers=args.workers)
+    budget = None
+    if args.orcamento:
+        if Path(args.orcamento).exists():
+            budget = load_budget_data(args.orcamento)
+        else:
+            print(f"Aviso: orçamento '{args.orcamento}' não encontrado; Orçado x Realizado não será gerado.", file=sys.stderr)
+    t1 = time.perf_counter()
+    if args.verificar:
+        tables = compute_tables(df, budget, args.periodo)
+        problems = compare_tables(tables, compute_tables(None, budget, args.periodo, backend=backend))
+        for p in problems:
+            print(f"Divergência pandas x duckdb – {p}", file=sys.stderr)
+        if problems:
+            return 1
+        print("pandas e duckdb: tabelas idênticas", file=sys.stderr)
+    else:
+        tables = compute_tables(df, budget, args.periodo, backend=backend if args.backend == "duckdb" else None)
+    t2 = time.perf_counter()
+    paths = write_tables(tables, args.saida, args.formato, max_workers=args.workers)
+    t3 = time.perf_counter()
+
+    for name, table in tables.items():
+        print(f"{name}: {len(table)} linhas", file=sys.stderr)
+    for p in paths:
+        print(p)
+    print(f"leitura {t1 - t0:.2f}s | cálculo {t2 - t1:.2f}s | escrita {t3 - t2:.2f}s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1005 @@
+"""
+Camada de cálculo da DRE (sem dependência do Streamlit).
+"""
+import hashlib
+import html
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+# -----------------------------
+# Formatação pt-BR
+# -----------------------------
+def money(x):
+    try:
+        return f"R$ {float(x):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+    except Exception:
+        return "R$ 0,00"
+
+def perc(x):
+    try:
+        return (f"{float(x)*100:,.2f}%").replace(",", "X").replace(".", ",").replace("X", ".")
+    except Exception:
+        return "0,00%"
+
+def _render_br(v: np.ndarray, prefix: str, suffix: str) -> np.ndarray:
+    """
+    Monta "<prefix>[-]1.234,56<suffix>" para um vetor finito, dígito a
+    dígito numa matriz de bytes (uma coluna por caractere), sem laço em
+    Python por elemento.
+    """
+    n = len(v)
+    neg = np.signbit(v)
+    cents = np.rint(np.abs(v) * 100).astype(np.int64)
+    # Dígitos de `cents` (mínimo 3: "0,00")
+    nd = np.maximum(3, np.floor(np.log10(np.maximum(cents, 1))).astype(np.int64) + 1)
+    maxd = int(nd.max()) if n else 3
+    width_num = maxd + 1 + (maxd - 3) // 3
+    pre = np.frombuffer(prefix.encode("ascii"), dtype=np.uint8)
+    suf = np.frombuffer(suffix.encode("ascii"), dtype=np.uint8)
+    width = len(pre) + 1 + width_num + len(suf)
+
+    m = np.full((n, width), ord(" "), dtype=np.uint8)
+    if len(suf):
+        m[:, width - len(suf):] = suf
+    end = width - len(suf)
+    rem = cents.copy()
+    k = 0
+    # Da direita para a esquerda: 2 decimais, vírgula, milhares separados por ponto
+    for r in range(width_num):
+        col = end - 1 - r
+        if r == 2:
+            m[:, col] = ord(",")
+        elif r >= 3 and (r - 3) % 4 == 3:
+            m[:, col] = np.where(k < nd, ord("."), ord(" "))
+        else:
+            m[:, col] = np.where(k < nd, rem % 10 + ord("0"), ord(" "))
+            rem //= 10
+            k += 1
+
+    rows = np.arange(n)
+    start = end - (nd + 1 + (nd - 3) // 3) - neg
+    m[rows[neg], start[neg]] = ord("-")
+    for i, b in enumerate(pre):
+        m[rows, start - len(pre) + i] = b
+    return np.char.lstrip(m.view(f"S{width}").ravel().astype(f"U{width}"))
+
+# Abaixo disso (Top-N, comparativos, DRE de ~14 linhas) a versão escalar é mais rápida que montar a matriz
+_FORMAT_VECTOR_MIN = 300
+
+def _format_br(values, scale: float, prefix: str, suffix: str, fallback) -> pd.Series:
+    """
+    Versão em lote de `money`/`perc`: mesma saída, elemento a elemento.
+    NaN/inf de float saem como "nan"/"inf" (como na f-string); NA, None e
+    texto não numérico saem como zero, igual ao `except` das versões escalares.
+    """
+    s = values if isinstance(values, pd.Series) else pd.Series(values)
+    if len(s) < _FORMAT_VECTOR_MIN:
+        return pd.Series([fallback(x) for x in s], index=s.index, dtype=object)
+    if isinstance(s.dtype, np.dtype) and s.dtype.kind in "fiub":
+        v = s.to_numpy(dtype=float)
+        invalid = np.zeros(len(s), dtype=bool)
+    else:
+        num = pd.to_numeric(s, errors="coerce")
+        v = num.to_numpy(dtype=float, na_value=np.nan)
+        invalid = num.isna().to_numpy().copy()
+        if invalid.any() and s.dtype == object:
+            # float('nan') dentro de coluna object continua saindo como "nan"
+            raw = s.to_numpy()
+            for i in np.flatnonzero(invalid):
+                if isinstance(raw[i], float):
+                    invalid[i] = False
+    raw_v = v
+    if scale != 1:
+        v = v * scale
+
+    finite = np.isfinite(v) & ~invalid
+    with np.errstate(invalid="ignore"):
+        scaled = np.abs(v * 100)
+        # Quase-empates (x,xx5) podem arredondar diferente do format(), e
+        # valores enormes não cabem em centavos int64: ficam com a versão escalar
+        tol = np.maximum(1e-6, 8 * np.spacing(scaled))
+        slow = finite & ((np.abs(scaled % 1 - 0.5) < tol) | (scaled >= 1e17))
+    fast = finite & ~slow
+
+    out = np.empty(len(s), dtype=object)
+    out[fast] = _render_br(v[fast], prefix, suffix)
+    out[invalid] = fallback(None)
+    for i in np.flatnonzero(~finite & ~invalid):
+        out[i] = f"{prefix}{v[i]}{suffix}"
+    for i in np.flatnonzero(slow):
+        out[i] = fallback(raw_v[i])
+    return pd.Series(out, index=s.index)
+
+def money_series(values) -> pd.Series:
+    """`money` vetorizado para Series/arrays (R$ 1.234,56)."""
+    return _format_br(values, 1, "R$ ", "", money)
+
+def perc_series(values) -> pd.Series:
+    """`perc` vetorizado para Series/arrays (12,34%)."""
+    return _format_br(values, 100, "", "%", perc)
+
+# -----------------------------
+# Resolução de colunas
+# -----------------------------
+def resolve_col(df: pd.DataFrame, candidates):
+    for c in candidates:
+        if c in df.columns:
+            return c
+    return None
+
+def resolve_col_ci(df: pd.DataFrame, targets: list[str], fallback_first: bool = True):
+    """
+    Resolve o nome de uma coluna de forma case-insensitive,
+    comparando contra aliases-alvo. Se não encontrar e fallback_first=True,
+    retorna a primeira coluna.
+    """
+    cols = list(df.columns)
+    lowered = {str(c): str(c).strip().lower() for c in cols}
+    target_norm = [t.strip().lower() for t in targets]
+    for cname, low in lowered.items():
+        if low in target_norm:
+            return cname
+    if fallback_first and cols:
+        return cols[0]
+    return None
+
+# -----------------------------
+# Mapeamento de colunas (candidatos) – BD.xlsx
+# -----------------------------
+C_FAT = ["FAT MÊS $", "FAT MES $", "FAT_MES_$", "FAT_MES", "FAT"]
+E_DED = ["DEDUÇÕES LEGAIS", "DEDUCOES LEGAIS", "DEDUCOES", "DEDUÇÕES"]
+K_SAL = ["SALÁRIO", "SALARIO"]
+L_VT  = ["VALE TRANSPORTE", "VT"]
+M_VA  = ["VALE ALIMENTAÇÃO", "VALE ALIMENTACAO", "VA"]
+N_VR  = ["VALE REFEIÇÃO", "VALE REFEICAO", "VR"]
+O_ASS = ["ASSIDUIDADE"]
+S_ENC = ["TOTAL ENCARGOS", "ENCARGOS", "TOTAL_ENCARGOS"]
+AA_FT = ["FT"]
+AB_FR = ["FREELANCE"]
+U_RATEIO = ["RATEIO MP", "RATEIO_MP", "RATEIO"]
+MCOL = ["MATERIAL DE CONSUMO", "MATERIAL_CONSUMO", "MAT CONSUMO"]
+
+# Ordem das linhas de custo na DRE
+COST_CANDIDATES = [K_SAL, L_VT, M_VA, N_VR, O_ASS, S_ENC, AA_FT, AB_FR, U_RATEIO, MCOL]
+
+@dataclass
+class DreSchema:
+    col_empresa: str
+    col_periodo: str
+    col_fat: str | None
+    col_ded: str | None
+    cost_cols: list[str]
+
+    @property
+    def has_mes_ref(self) -> bool:
+        return self.col_periodo == "MÊS REF"
+
+    @property
+    def value_cols(self) -> list[str]:
+        return [c for c in [self.col_fat, self.col_ded] if c] + self.cost_cols
+
+def resolve_schema(df: pd.DataFrame) -> DreSchema:
+    col_empresa = "EMPRESA" if "EMPRESA" in df.columns else list(df.columns)[0]
+    # PRIORIDADE: nova coluna "MÊS REF"; fallback para "TIMES"
+    if "MÊS REF" in df.columns:
+        col_periodo = "MÊS REF"
+    else:
+        col_periodo = "TIMES" if "TIMES" in df.columns else ( [c for c in df.columns if c.lower().startswith("time")] + [list(df.columns)[-1]] )[0]
+    cost_cols = [c for c in (resolve_col(df, cands) for cands in COST_CANDIDATES) if c is not None]
+    return DreSchema(col_empresa, col_periodo, resolve_col(df, C_FAT), resolve_col(df, E_DED), cost_cols)
+
+def period_keys(df: pd.DataFrame, schema: DreSchema) -> pd.Series:
+    """Chave de período: MÊS REF (datetime) ou, no legado, o texto de TIMES."""
+    if schema.has_mes_ref:
+        return df["MÊS REF"]
+    return df[schema.col_periodo].where(df[schema.col_periodo].isna(), df[schema.col_periodo].astype(str))
+
+# Colunas do REALIZADO usadas no "Orçado x Realizado" (podem ter nomes levemente distintos)
+REAL_FAT = ["FAT MÊS $","(+) FATURAMENTO BRUTO"]
+REAL_DED = ["DEDUÇÕES LEGAIS","(-) DEDUÇÕES LEGAIS"]
+REAL_COSTS = [
+    ["SALÁRIO","(-) SALÁRIO"],
+    ["VALE TRANSPORTE ","(-) VALE TRANSPORTE "],
+    ["VALE ALIMENTAÇÃO","(-) VALE ALIMENTAÇÃO"],
+    ["VALE REFEIÇÃO","(-) VALE REFEIÇÃO"],
+    ["ASSIDUIDADE","(-) ASSIDUIDADE"],
+    ["MATERIAL DE CONSUMO","(-) MATERIAL DE CONSUMO"],
+    ["TOTAL ENCARGOS","(-) TOTAL ENCARGOS"],
+]
+
+def resolve_real_cols(df: pd.DataFrame):
+    """(fat, deduções, custos) do REALIZADO para comparação com o orçamento."""
+    costs = [c for c in (resolve_col(df, cands) for cands in REAL_COSTS) if c]
+    return resolve_col(df, REAL_FAT), resolve_col(df, REAL_DED), costs
+
+# -----------------------------
+# Plano de leitura do BD.xlsx (colunas e tipos)
+# -----------------------------
+# Entra na chave do cache em disco: muda quando qualquer lista de candidatos muda
+BD_PLAN_KEY = hashlib.sha1(repr((C_FAT, E_DED, COST_CANDIDATES, REAL_FAT, REAL_DED, REAL_COSTS)).encode("utf-8")).hexdigest()[:12]
+
+def _header_frame(header) -> pd.DataFrame:
+    return pd.DataFrame(columns=list(header))
+
+def bd_value_cols(header) -> list[str]:
+    df = _header_frame(header)
+    schema = resolve_schema(df)
+    real_fat, real_ded, real_costs = resolve_real_cols(df)
+    cols = schema.value_cols + [c for c in [real_fat, real_ded] + real_costs if c]
+    return list(dict.fromkeys(cols))
+
+def bd_usecols(header) -> list[str]:
+    """Só as colunas que os candidatos resolvem, mais EMPRESA/período (e TIMES, se houver)."""
+    schema = resolve_schema(_header_frame(header))
+    wanted = {schema.col_empresa, schema.col_periodo, "EMPRESA", "MÊS REF", "TIMES", *bd_value_cols(header)}
+    return [c for c in header if c in wanted]
+
+def canonicalize_bd(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Renomeia os aliases resolvidos de um arquivo para o primeiro candidato
+    de cada lista, para que planilhas com títulos diferentes se alinhem
+    na concatenação.
+    """
+    ren = {}
+    if "EMPRESA" not in df.columns:
+        ren[resolve_schema(df).col_empresa] = "EMPRESA"
+    for cands in [C_FAT, E_DED, *COST_CANDIDATES, REAL_FAT, REAL_DED, *REAL_COSTS]:
+        col, target = resolve_col(df, cands), cands[0].strip()
+        if col and col != target and target not in df.columns and col not in ren:
+            ren[col] = target
+    return df.rename(columns=ren) if ren else df
+
+def bd_dtypes(header) -> dict:
+    """Tipo final de cada coluna para `stream_sheet`: valores numéricos e MÊS REF datetime."""
+    plan = {c: "numeric" for c in bd_value_cols(header)}
+    if "MÊS REF" in header:
+        plan["MÊS REF"] = "datetime"
+    return plan
+
+# -----------------------------
+# Base compacta (cache do app): categorias e centavos inteiros
+# -----------------------------
+CENTS = 100
+
+def to_cents(values) -> pd.Series:
+    """R$ -> centavos inteiros (Int64, NA onde não há número). Só para valores exatos ao centavo (`cents_exact`)."""
+    num = pd.to_numeric(values, errors="coerce").astype(float)
+    return np.round(num * CENTS).astype("Int64")
+
+def cents_exact(values) -> bool:
+    """True se todos os valores já são centavos inteiros (a menos do ruído de ponto flutuante de x * 100)."""
+    num = pd.to_numeric(values, errors="coerce").astype(float).to_numpy()
+    scaled = num[~np.isnan(num)] * CENTS
+    return bool(np.isclose(scaled, np.round(scaled), rtol=1e-12, atol=1e-6).all())
+
+def cents_cols(df: pd.DataFrame, cols) -> list[str]:
+    """Colunas de valor guardadas em centavos (as inteiras)."""
+    return [c for c in cols if c in df.columns and pd.api.types.is_integer_dtype(df[c].dtype)]
+
+def from_cents(df: pd.DataFrame) -> pd.DataFrame:
+    """Colunas em centavos de volta em R$ (para exibir/exportar linhas brutas); as demais não são copiadas."""
+    return df.assign(**{c: df[c].astype("Float64") / CENTS for c in cents_cols(df, df.columns)})
+
+def summable(df: pd.DataFrame, cols) -> pd.DataFrame:
+    """
+    Colunas de valor prontas para somar, sem NA: centavos continuam
+    inteiros (soma exata), o resto vira float.
+    """
+    cents = set(cents_cols(df, cols))
+    return pd.DataFrame({
+        c: df[c].fillna(0).astype(np.int64) if c in cents else pd.to_numeric(df[c], errors="coerce").fillna(0.0)
+        for c in cols
+    }, index=df.index)
+
+def _reais(sums, cents) -> pd.DataFrame | pd.Series:
+    """Somas de volta em R$ (float): só as colunas em centavos são divididas."""
+    out = sums.astype(float)
+    if len(cents):
+        out[list(cents)] = out[list(cents)] / CENTS
+    return out
+
+def frame_memory(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+def compact_bd(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Base enxuta para manter em memória: só EMPRESA, período(s),
+    PERIODO_LABEL e as colunas de valor que a DRE resolve; EMPRESA e
+    PERIODO_LABEL categóricas; valores em centavos inteiros (Int64). Colunas
+    com frações de centavo (resultado de fórmulas) ficam em float, para que
+    os totais batam com as somas da própria planilha.
+    """
+    schema = resolve_schema(df)
+    value_cols = bd_value_cols(df.columns)
+    keep = [c for c in bd_usecols(df.columns) if c in df.columns]
+    if "PERIODO_LABEL" in df.columns:
+        keep.append("PERIODO_LABEL")
+    out = pd.DataFrame(index=df.index)
+    for c in keep:
+        s = df[c]
+        if c in value_cols:
+            s = to_cents(s) if cents_exact(s) else pd.to_numeric(s, errors="coerce").astype(float)
+        elif c == schema.col_empresa or c == "PERIODO_LABEL":
+            s = s.where(s.isna(), s.astype(str)).astype("category")
+        out[c] = s
+    return out
+
+# -----------------------------
+# Linhas da DRE
+# -----------------------------
+def compute_totals(dff: pd.DataFrame, schema: DreSchema):
+    cols = [c for c in [schema.col_fat, schema.col_ded] + schema.cost_cols if c]
+    sums = _reais(summable(dff, cols).sum(), cents_cols(dff, cols))
+    fat_bruto = sums[schema.col_fat] if schema.col_fat else 0
+    deducoes = sums[schema.col_ded] if schema.col_ded else 0
+    fat_liq = fat_bruto - deducoes
+    csp = sums[schema.cost_cols].sum() if schema.cost_cols else 0
+    mc = fat_liq - csp
+    return fat_bruto, deducoes, fat_liq, csp, mc
+
+def dre_lines(sums: pd.DataFrame, col_fat, col_ded, cost_cols) -> pd.DataFrame:
+    """
+    Mesmas linhas de `compute_totals`, vetorizadas: recebe as somas das
+    colunas de origem (uma linha por grupo) e devolve FAT BRUTO, DEDUÇÕES,
+    FAT LÍQ, cada custo, CSP, MC e MC% (sobre FAT BRUTO).
+    """
+    out = pd.DataFrame(index=sums.index)
+    out["FAT BRUTO"] = sums[col_fat] if col_fat else 0.0
+    out["DEDUÇÕES"] = sums[col_ded] if col_ded else 0.0
+    out["FAT LÍQ"] = out["FAT BRUTO"] - out["DEDUÇÕES"]
+    for c in cost_cols:
+        out[c] = sums[c]
+    out["CSP"] = sums[cost_cols].sum(axis=1) if cost_cols else 0.0
+    out["MC"] = out["FAT LÍQ"] - out["CSP"]
+    denom = out["FAT BRUTO"].where(out["FAT BRUTO"] != 0)
+    out["MC%"] = (out["MC"] / denom).fillna(0.0)
+    return out.astype(float)
+
+def block_lines(df_block: pd.DataFrame, col_fat, col_ded, cost_cols) -> pd.Series:
+    """Linhas da DRE de um recorte de linhas brutas (colunas ausentes valem 0)."""
+    cols = [c for c in [col_fat, col_ded] + list(cost_cols) if c]
+    present = [c for c in cols if c in df_block.columns]
+    sums = _reais(summable(df_block, present).sum(), cents_cols(df_block, present)).reindex(cols, fill_value=0.0)
+    return dre_lines(sums.to_frame().T, col_fat, col_ded, cost_cols).iloc[0]
+
+def dre_statement(linhas: pd.Series, cost_cols) -> pd.DataFrame:
+    """
+    Demonstrativo pronto para exibição: uma linha por item da DRE com
+    valor, AV% (sobre FAT BRUTO), destaque e divisória antes da linha.
+    """
+    spec = [
+        ("(+) FATURAMENTO BRUTO", "FAT BRUTO", True, False),
+        ("(–) DEDUÇÕES LEGAIS", "DEDUÇÕES", False, False),
+        ("(=) FATURAMENTO LÍQUIDO", "FAT LÍQ", True, False),
+        ("(–) CSP", "CSP", True, True),
+    ]
+    spec += [(f"(–) {c}", c, False, False) for c in cost_cols]
+    spec += [("(=) MARGEM DE CONTRIBUIÇÃO", "MC", True, True)]
+    valores = np.array([float(linhas.get(k, 0.0)) for _, k, _, _ in spec])
+    fat = float(linhas.get("FAT BRUTO", 0.0))
+    return pd.DataFrame({
+        "Linha": [s_[0] for s_ in spec],
+        "Valor": valores,
+        "AV%": valores / fat if fat != 0 else np.zeros(len(spec)),
+        "destaque": [s_[2] for s_ in spec],
+        "divisoria": [s_[3] for s_ in spec],
+    })
+
+def statement_table_html(heading: str, stmt: pd.DataFrame, valores, avs) -> str:
+    """
+    DRE inteira (rótulos, R$, AV%, destaques e divisórias) num único
+    elemento HTML, a partir de `dre_statement` e dos valores já formatados.
+    """
+    rows = []
+    for label, valor, av, destaque, divisoria in zip(stmt["Linha"], valores, avs, stmt["destaque"], stmt["divisoria"]):
+        label = html.escape(label)
+        if destaque:
+            label = f"<b>{label}</b>"
+        borda = "border-top:1px solid rgba(128,128,128,.35);" if divisoria else ""
+        rows.append(
+            f"<tr style='{borda}'><td style='width:58%;padding:.3rem 0'>{label}</td>"
+            f"<td style='width:25%;text-align:right'>{valor}</td>"
+            f"<td style='width:17%;text-align:right'>{av}</td></tr>"
+        )
+    return (
+        "<hr style='margin:.8rem 0'>"
+        f"<h4>{html.escape(heading)} | AV%</h4>"
+        "<table style='width:100%;border-collapse:collapse;border:none'>"
+        + "".join(rows)
+        + "</table>"
+    )
+
+# -----------------------------
+# Cubo agregado (período × EMPRESA)
+# -----------------------------
+@dataclass
+class DreCube:
+    """
+    Todas as linhas da DRE pré-calculadas por (período, cliente) e o
+    consolidado por período. Chaves de cliente em str, como nos filtros.
+    """
+    schema: DreSchema
+    by_client: pd.DataFrame
+    consolidated: pd.DataFrame
+
+    def _zeros(self) -> pd.Series:
+        return pd.Series(0.0, index=self.consolidated.columns)
+
+    def get(self, cliente, periodo) -> pd.Series:
+        try:
+            return self.by_client.loc[(periodo, str(cliente))]
+        except KeyError:
+            return self._zeros()
+
+    def total(self, periodo) -> pd.Series:
+        try:
+            return self.consolidated.loc[periodo]
+        except KeyError:
+            return self._zeros()
+
+    def client_series(self, cliente) -> pd.DataFrame:
+        """Todas as linhas da DRE do cliente em todos os períodos (0 onde não há movimento)."""
+        try:
+            serie = self.by_client.xs(str(cliente), level=1)
+        except KeyError:
+            serie = self.by_client.iloc[0:0].droplevel(1)
+        return serie.reindex(self.consolidated.index, fill_value=0.0)
+
+    def period_slice(self, periodo) -> pd.DataFrame:
+        """Uma linha por cliente do período (base do Dashboard)."""
+        try:
+            return self.by_client.xs(periodo, level=0)
+        except KeyError:
+            return self.by_client.iloc[0:0].droplevel(0)
+
+def group_lines(df: pd.DataFrame, schema: DreSchema, col_fat, col_ded, cost_cols):
+    """
+    Linhas da DRE de `df` agrupadas por (período, cliente) e por período,
+    para qualquer conjunto de colunas de origem (as do schema ou as do
+    REALIZADO usadas contra o orçamento).
+    """
+    cols = [c for c in [col_fat, col_ded] + list(cost_cols) if c]
+    values = summable(df, cols)
+    cents = cents_cols(df, cols)
+    per = period_keys(df, schema)
+    emp = df[schema.col_empresa]
+    emp = emp.where(emp.isna(), emp.astype(str))
+
+    # observed=True: com EMPRESA categórica, só os pares (período, cliente) que existem na base
+    sums = _reais(values.groupby([per.rename("PERIODO"), emp], sort=True, observed=True).sum(), cents)
+    # Cliente em texto simples, não categórico: cubo inteiro e atualização incremental (_splice) com o mesmo índice
+    sums.index = sums.index.set_levels(sums.index.levels[1].astype(str), level=1)
+    # Consolidado a partir das linhas brutas (inclui linhas sem EMPRESA)
+    sums_total = _reais(values.groupby(per.rename("PERIODO"), sort=True, observed=True).sum(), cents)
+    return dre_lines(sums, col_fat, col_ded, cost_cols), dre_lines(sums_total, col_fat, col_ded, cost_cols)
+
+def build_dre_cube(df: pd.DataFrame, schema: DreSchema) -> DreCube:
+    by_client, consolidated = group_lines(df, schema, schema.col_fat, schema.col_ded, schema.cost_cols)
+    return DreCube(schema, by_client, consolidated)
+
+# -----------------------------
+# Atualização incremental (meses novos ou alterados)
+# -----------------------------
+def period_hashes(df: pd.DataFrame, schema: DreSchema) -> dict:
+    """
+    Impressão digital do conteúdo de cada período (nomes e valores de
+    EMPRESA e de todas as colunas de valor – as da DRE e as do REALIZADO –,
+    na ordem das linhas): compara duas versões da base sem precisar
+    guardar a anterior.
+    """
+    cols = [c for c in dict.fromkeys([schema.col_empresa, *schema.value_cols, *bd_value_cols(df.columns)])
+            if c in df.columns]
+    names = "\x1f".join(cols).encode("utf-8")
+    codes, uniques = pd.factorize(period_keys(df, schema), sort=True)
+    row_hash = pd.util.hash_pandas_object(df[cols], index=False).to_numpy()
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    keys = uniques.tolist()
+    out = {}
+    for start, stop in zip(*_runs(sorted_codes)):
+        code = sorted_codes[start]
+        if code >= 0:
+            digest = hashlib.blake2b(names, digest_size=16)
+            digest.update(row_hash[order[start:stop]].tobytes())
+            out[keys[code]] = digest.hexdigest()
+    return out
+
+def changed_periods(old: dict, new: dict) -> set:
+    """Períodos novos, removidos ou com conteúdo diferente."""
+    return {p for p in old.keys() | new.keys() if old.get(p) != new.get(p)}
+
+def update_dre_cube(cube: DreCube, df: pd.DataFrame, schema: DreSchema, periods) -> DreCube:
+    """
+    Cubo de `df` recalculando só `periods`; os demais períodos vêm de
+    `cube` como estão. Se o schema mudou, recalcula tudo.
+    """
+    if cube.schema != schema:
+        return build_dre_cube(df, schema)
+    periods = list(periods)
+    if not periods:
+        return cube
+    rows = period_keys(df, schema).isin(periods).to_numpy()
+    by_client, consolidated = group_lines(df[rows], schema, schema.col_fat, schema.col_ded, schema.cost_cols)
+    return DreCube(schema, _splice(cube.by_client, by_client, periods), _splice(cube.consolidated, consolidated, periods))
+
+def update_real_lines(lines: pd.DataFrame, df: pd.DataFrame, schema: DreSchema, periods) -> pd.DataFrame:
+    """
+    REALIZADO por (período, cliente) de `df` – `group_lines` com as colunas
+    de `resolve_real_cols` – recalculando só `periods`; os demais vêm de
+    `lines`. O chamador recalcula tudo se o schema ou as colunas mudaram.
+    """
+    periods = list(periods)
+    if not periods:
+        return lines
+    rows = period_keys(df, schema).isin(periods).to_numpy()
+    by_client, _ = group_lines(df[rows], schema, *resolve_real_cols(df))
+    return _splice(lines, by_client, periods)
+
+def _splice(old: pd.DataFrame, new: pd.DataFrame, periods) -> pd.DataFrame:
+    """`old` sem as linhas de `periods` (1º nível do índice) mais as recalculadas."""
+    keep = ~old.index.get_level_values(0).isin(periods)
+    return pd.concat([old[keep], new]).sort_index()
+
+# -----------------------------
+# Rankings
+# -----------------------------
+RANK_METRICS = ["FAT BRUTO", "CSP", "MC", "MC%"]
+
+def rank_clients(by_client: pd.DataFrame) -> pd.DataFrame:
+    """
+    Posição de cada cliente dentro do seu período em FAT BRUTO, CSP, MC e
+    MC% (1 = maior), para todos os períodos de uma vez.
+    """
+    out = by_client[RANK_METRICS]
+    grouped = by_client.groupby(level=0, sort=False)
+    for metric in RANK_METRICS:
+        out[f"RANK {metric}"] = grouped[metric].rank(ascending=False, method="first").astype(int)
+    return out
+
+# -----------------------------
+# Série histórica (tendência)
+# -----------------------------
+TREND_LINES = ["FAT BRUTO", "FAT LÍQ", "CSP", "MC"]
+
+def _full_months(serie: pd.DataFrame) -> pd.DataFrame:
+    """Série com todos os meses entre o primeiro e o último (fim do mês), zerando os ausentes."""
+    if serie.empty:
+        return serie
+    months = serie.index.to_period("M")
+    full = pd.period_range(months.min(), months.max(), freq="M")
+    if len(full) == len(months):
+        return serie
+    own = dict(zip(months, serie.index))
+    index = pd.DatetimeIndex([own.get(m, m.to_timestamp(how="end").normalize()) for m in full], name=serie.index.name)
+    return serie.set_axis(months).reindex(full, fill_value=0.0).set_axis(index)
+
+def dre_trend(serie: pd.DataFrame) -> pd.DataFrame:
+    """
+    Recebe as linhas da DRE por período (saída de `client_series` ou
+    `consolidated`) e acrescenta, de uma vez para todos os meses:
+    variação mês a mês, acumulado no ano (só com MÊS REF) e MC% móvel de
+    3 e 12 meses (somas móveis de MC ÷ FAT BRUTO). Com MÊS REF, meses sem
+    movimento entram zerados, para que Δ e janelas móveis contem meses de
+    calendário e não linhas.
+    """
+    if isinstance(serie.index, pd.DatetimeIndex):
+        serie = _full_months(serie)
+    out = {f"Δ {c}": serie[c].diff() for c in TREND_LINES}
+    out["Δ MC%"] = serie["MC%"].diff()
+
+    def ratio(num, den):
+        return num / den.where(den != 0)
+
+    if isinstance(serie.index, pd.DatetimeIndex):
+        ytd = serie[TREND_LINES].groupby(serie.index.year).cumsum()
+        for c in TREND_LINES:
+            out[f"{c} YTD"] = ytd[c]
+        out["MC% YTD"] = ratio(ytd["MC"], ytd["FAT BRUTO"]).fillna(0.0)
+    for w in (3, 12):
+        roll = serie[["MC", "FAT BRUTO"]].rolling(w, min_periods=w).sum()
+        out[f"MC% {w}M"] = ratio(roll["MC"], roll["FAT BRUTO"])
+    # Série original intacta (pode ser o consolidado compartilhado do cubo)
+    return serie.assign(**out)
+
+# -----------------------------
+# Índice de linhas (período, cliente)
+# -----------------------------
+@dataclass
+class RowIndex:
+    """
+    Posições das linhas da base ordenadas (estável) por período e cliente.
+    Cada período – e cada (período, cliente) dentro dele – vira um trecho
+    contíguo de `order`, então buscar as linhas de uma seleção custa o
+    tamanho do resultado, sem máscaras sobre a tabela inteira.
+    """
+    order: np.ndarray
+    by_period: dict
+    by_client_period: dict = field(repr=False)
+    period_codes: dict = field(repr=False)
+    client_codes: dict = field(repr=False)
+
+    def _pair_code(self, cliente, periodo):
+        # Chave inteira (período, cliente): hashear tuplas com Timestamp é caro para centenas de milhares de pares
+        p, e = self.period_codes.get(periodo), self.client_codes.get(str(cliente))
+        if p is None or e is None:
+            return None
+        return p * (len(self.client_codes) + 1) + e + 1
+
+    def period_positions(self, periodo) -> np.ndarray:
+        start, stop = self.by_period.get(periodo, (0, 0))
+        # Devolve na ordem original da planilha (custo proporcional ao período)
+        return np.sort(self.order[start:stop])
+
+    def client_period_positions(self, cliente, periodo) -> np.ndarray:
+        start, stop = self.by_client_period.get(self._pair_code(cliente, periodo), (0, 0))
+        return self.order[start:stop]
+
+    def period_rows(self, df: pd.DataFrame, periodo) -> pd.DataFrame:
+        return df.iloc[self.period_positions(periodo)]
+
+    def client_period_rows(self, df: pd.DataFrame, cliente, periodo) -> pd.DataFrame:
+        return df.iloc[self.client_period_positions(cliente, periodo)]
+
+def _runs(codes: np.ndarray):
+    """(início, fim) de cada sequência de códigos iguais num vetor ordenado."""
+    if len(codes) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    starts = np.r_[0, np.flatnonzero(np.diff(codes)) + 1]
+    stops = np.r_[starts[1:], len(codes)]
+    return starts, stops
+
+def build_row_index(df: pd.DataFrame, schema: DreSchema) -> RowIndex:
+    per = period_keys(df, schema)
+    emp = df[schema.col_empresa]
+    emp = emp.where(emp.isna(), emp.astype(str))
+    per_codes, per_uniques = pd.factorize(per, sort=True)
+    emp_codes, emp_uniques = pd.factorize(emp, sort=True)
+
+    # Ordena uma vez por (período, cliente); lexsort é estável e mantém a ordem original dentro do grupo
+    order = np.lexsort((emp_codes, per_codes))
+    order.setflags(write=False)  # compartilhado entre sessões
+    per_sorted = per_codes[order]
+    emp_sorted = emp_codes[order]
+
+    per_keys = per_uniques.tolist()
+    starts, stops = _runs(per_sorted)
+    by_period = {per_keys[c]: (a, b) for c, a, b in zip(per_sorted[starts].tolist(), starts.tolist(), stops.tolist())
+                 if c >= 0}
+
+    # Códigos combinados: muda sempre que período ou cliente mudam
+    pair = per_sorted.astype(np.int64) * (len(emp_uniques) + 1) + (emp_sorted + 1)
+    starts, stops = _runs(pair)
+    valid = (per_sorted[starts] >= 0) & (emp_sorted[starts] >= 0)
+    starts, stops = starts[valid], stops[valid]
+    by_client_period = dict(zip(pair[starts].tolist(), zip(starts.tolist(), stops.tolist())))
+    return RowIndex(order, by_period, by_client_period,
+                    period_codes={k: i for i, k in enumerate(per_keys)},
+                    client_codes={k: i for i, k in enumerate(emp_uniques.tolist())})
+
+# -----------------------------
+# Grade de QA (paginada no servidor)
+# -----------------------------
+def _contains(values: pd.Series, text: str) -> np.ndarray:
+    """Máscara "contém" (sem diferenciar maiúsculas); categóricas testam só as categorias."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        hits = values.cat.categories.astype(str).str.contains(text, case=False, regex=False)
+        codes = values.cat.codes.to_numpy()
+        return np.append(np.asarray(hits, dtype=bool), False)[codes]  # código -1 (NA) cai no False
+    return values.astype(str).str.contains(text, case=False, regex=False, na=False).to_numpy(dtype=bool)
+
+def qa_positions(df: pd.DataFrame, positions, sort_by=None, ascending: bool = True,
+                 filter_col=None, filter_text: str = "") -> np.ndarray:
+    """
+    Posições (de RowIndex/BudgetData) filtradas e ordenadas. Só as colunas
+    usadas no filtro/ordenação são lidas, e só nas linhas do recorte.
+    """
+    pos = np.asarray(positions, dtype=np.int64)
+    if filter_col and filter_text:
+        values = df[filter_col].iloc[pos]
+        if filter_col in cents_cols(df, [filter_col]):
+            values = from_cents(values.to_frame())[filter_col]  # filtra pelo valor em R$, como exibido
+        pos = pos[_contains(values.reset_index(drop=True), filter_text)]
+    if sort_by:
+        keys = df[sort_by].iloc[pos].reset_index(drop=True)
+        try:
+            ranked = keys.sort_values(ascending=ascending, kind="stable", na_position="last")
+        except TypeError:  # coluna de texto com tipos misturados
+            ranked = keys.astype(str).sort_values(ascending=ascending, kind="stable")
+        pos = pos[ranked.index.to_numpy()]
+    return pos
+
+def qa_page(df: pd.DataFrame, positions, page: int, page_size: int, columns=None) -> pd.DataFrame:
+    """Só as linhas da página `page` (0-based), nas colunas pedidas, em R$."""
+    start = max(page, 0) * page_size
+    rows = df.iloc[np.asarray(positions)[start:start + page_size]]
+    if columns is not None:
+        rows = rows[list(columns)]
+    return from_cents(rows)
+
+# -----------------------------
+# Orçamento (BD CONT NOVO.xlsx)
+# -----------------------------
+# (nome exato, aliases case-insensitive) – conforme títulos fornecidos
+BUD_CLIENTE = ("Cliente", ["cliente","empresa","contrato"])
+BUD_FAT = ("(+) FATURAMENTO BRUTO", ["(+) faturamento bruto","faturamento bruto"])
+BUD_DED = ("(-) DEDUÇÕES LEGAIS", ["(-) deduções legais","deduções legais","deducoes legais"])
+BUD_COSTS = [
+    ("(-) SALÁRIO", ["(-) salário","salário","salario"]),
+    ("(-) VALE TRANSPORTE ", ["(-) vale transporte","vale transporte"]),
+    ("(-) VALE ALIMENTAÇÃO", ["(-) vale alimentação","vale alimentacao","vale alimentação"]),
+    ("(-) VALE REFEIÇÃO", ["(-) vale refeição","vale refeicao","vale refeição"]),
+    ("(-) ASSIDUIDADE", ["(-) assiduidade","assiduidade"]),
+    ("(-) MATERIAL DE CONSUMO", ["(-) material de consumo","material de consumo"]),
+    ("(-) TOTAL ENCARGOS", ["(-) total encargos","total encargos","encargos"]),
+]
+
+def _resolve_budget_col(dfb: pd.DataFrame, spec, fallback_first: bool = False):
+    exact, aliases = spec
+    if exact in dfb.columns:
+        return exact
+    return resolve_col_ci(dfb, aliases, fallback_first=fallback_first)
+
+BUDGET_PLAN_KEY = hashlib.sha1(repr((BUD_CLIENTE, BUD_FAT, BUD_DED, BUD_COSTS)).encode("utf-8")).hexdigest()[:12]
+
+def budget_dtypes(header) -> dict:
+    """Linhas de valor do orçamento já como numéricas na leitura."""
+    dfb = _header_frame(header)
+    cols = [_resolve_budget_col(dfb, spec) for spec in [BUD_FAT, BUD_DED] + BUD_COSTS]
+    return {c: "numeric" for c in cols if c}
+
+@dataclass
+class BudgetData:
+    """
+    Orçamento já limpo e com o schema resolvido.
+
+    `totals` tem uma linha por cliente (chave em str) com a soma de cada
+    linha da DRE; `positions` aponta as linhas de `df` de cada cliente.
+    """
+    df: pd.DataFrame
+    sheet: str
+    col_cliente: str
+    col_fat: str | None
+    col_ded: str | None
+    cost_cols: list[str]
+    totals: pd.DataFrame
+    positions: dict = field(repr=False)
+
+    @property
+    def value_cols(self) -> list[str]:
+        return [c for c in [self.col_fat, self.col_ded] if c] + self.cost_cols
+
+    def lines(self) -> pd.DataFrame:
+        """Linhas da DRE orçada por cliente (FAT BRUTO, ..., MC, MC%)."""
+        return dre_lines(self.totals, self.col_fat, self.col_ded, self.cost_cols)
+
+    def client_positions(self, cliente) -> np.ndarray:
+        return np.asarray(self.positions.get(str(cliente), []), dtype=np.int64)
+
+    def client_rows(self, cliente) -> pd.DataFrame:
+        return self.df.iloc[self.client_positions(cliente)]
+
+def build_budget(dfb: pd.DataFrame, sheet: str) -> BudgetData:
+    # Cliente mantém o fallback para a primeira coluna; linhas de valor não
+    col_cliente = _resolve_budget_col(dfb, BUD_CLIENTE, fallback_first=True)
+    col_fat = _resolve_budget_col(dfb, BUD_FAT)
+    col_ded = _resolve_budget_col(dfb, BUD_DED)
+    cost_cols = [c for c in (_resolve_budget_col(dfb, spec) for spec in BUD_COSTS) if c]
+
+    value_cols = [c for c in [col_fat, col_ded] if c] + cost_cols
+    for c in value_cols:
+        dfb[c] = pd.to_numeric(dfb[c], errors="coerce")
+
+    keys = dfb[col_cliente].astype(str)
+    totals = dfb[value_cols].fillna(0).groupby(keys, sort=False).sum()
+    positions = {k: np.asarray(v) for k, v in keys.groupby(keys, sort=False).indices.items()}
+    return BudgetData(dfb, sheet, col_cliente, col_fat, col_ded, cost_cols, totals, positions)
+
+# -----------------------------
+# Orçado x Realizado
+# -----------------------------
+VARIANCE_LINES = ["FAT BRUTO","DEDUÇÕES","FAT LÍQ","CSP","MC"]
+
+def budget_comparison(orcado: pd.Series, realizado: pd.Series) -> pd.DataFrame:
+    """Tabela comparativa de um cliente: Orçado, Realizado, Δ (R$) e Δ (%) por linha."""
+    comp = pd.DataFrame({
+        "Linha": VARIANCE_LINES,
+        "Orçado (R$)": [float(orcado.get(k, 0.0)) for k in VARIANCE_LINES],
+        "Realizado (R$)": [float(realizado.get(k, 0.0)) for k in VARIANCE_LINES],
+    }).set_index("Linha")
+    comp["Δ (R$)"] = comp["Realizado (R$)"] - comp["Orçado (R$)"]
+    comp["Δ (%)"] = comp["Δ (R$)"] / comp["Orçado (R$)"].replace({0: pd.NA})
+    return comp
+
+def budget_variance(orcado: pd.DataFrame, realizado: pd.DataFrame) -> pd.DataFrame:
+    """
+    `budget_comparison` para todos os clientes numa única junção: recebe
+    as linhas da DRE orçada e realizada indexadas por cliente e devolve uma
+    linha por (cliente, linha da DRE). Clientes presentes só de um lado
+    entram com 0 do outro; Δ (%) fica NaN quando o orçado é 0.
+    """
+    orc, real = orcado[VARIANCE_LINES].align(realizado[VARIANCE_LINES], join="outer", fill_value=0.0)
+    long = pd.DataFrame({
+        "Orçado (R$)": orc.stack(),
+        "Realizado (R$)": real.stack(),
+    })
+    long.index.names = ["CLIENTE", "Linha"]
+    long["Δ (R$)"] = long["Realizado (R$)"] - long["Orçado (R$)"]
+    long["Δ (%)"] = long["Δ (R$)"] / long["Orçado (R$)"].where(long["Orçado (R$)"] != 0)
+    return long
+
+# +1: realizado acima do orçado é desfavorável (custos); -1: abaixo é desfavorável (receita/margem)
+ADVERSE_SIGN = {"FAT BRUTO": -1, "DEDUÇÕES": 1, "FAT LÍQ": -1, "CSP": 1, "MC": -1}
+
+def rank_deviations(variance: pd.DataFrame, linha: str = "MC", metric: str = "Δ (R$)") -> pd.DataFrame:
+    """
+    Clientes de `budget_variance` numa linha da DRE, do pior para o melhor
+    desvio: "Desvio desfavorável" é o Δ de `metric` com o sinal ajustado para que
+    maior seja sempre pior. Em Δ (%) a base é |orçado|, para que orçado
+    negativo (ex.: MC) não inverta o sentido; sem orçado (NaN) vai para o fim.
+    """
+    tab = variance.xs(linha, level="Linha")
+    delta = tab["Δ (R$)"]
+    if metric == "Δ (%)":
+        delta = delta / tab["Orçado (R$)"].abs().where(tab["Orçado (R$)"] != 0)
+    tab = tab.assign(**{"Desvio desfavorável": delta * ADVERSE_SIGN[linha]})
+    return tab.sort_values("Desvio desfavorável", ascending=False, na_position="last", kind="stable")
+
+def variance_matrix(variance: pd.DataFrame, metric: str = "Δ (R$)") -> pd.DataFrame:
+    """Uma linha por cliente, uma coluna por linha da DRE (valores de `metric`)."""
+    return variance[metric].unstack("Linha").reindex(columns=VARIANCE_LINES)
+
+
+# -----------------------------
+# Contratos (BD CONTRATOS.xlsx)
+# -----------------------------
+# Formato longo: uma linha por (Cliente, Bases) com o valor mensal contratado.
+# As colunas sem título da planilha são rascunho de cálculo e não são lidas.
+CON_CLIENTE = ("Cliente", ["cliente","empresa","contrato"])
+CON_BASE = ("Bases", ["bases","base","linha","conta"])
+CON_VALOR = ("Valor", ["valor","valor contratado","valor mensal"])
+
+CONTRACT_PLAN_KEY = hashlib.sha1(repr((CON_CLIENTE, CON_BASE, CON_VALOR)).encode("utf-8")).hexdigest()[:12]
+
+# "Bases" -> linha da DRE, pelos mesmos títulos/aliases do orçamento
+CONTRACT_LINES = [exact.strip() for exact, _ in [BUD_FAT, BUD_DED] + BUD_COSTS]
+_CONTRACT_LINE_OF = {alias.strip().lower(): exact.strip()
+                     for exact, aliases in [BUD_FAT, BUD_DED] + BUD_COSTS for alias in [exact, *aliases]}
+
+# Agrupamentos da visão de contratos: o próprio contrato e atributos derivados do valor contratado
+CONTRACT_GROUP = "Contrato"
+CONTRACT_ATTRS = ["Faixa de faturamento", "Faixa de margem", "Maior custo"]
+NO_CONTRACT = "(sem contrato)"
+MARGIN_BANDS = ([-np.inf, 0.0, 0.10, 0.20, 0.30, np.inf], ["< 0%", "0–10%", "10–20%", "20–30%", "≥ 30%"])
+
+def contract_usecols(header) -> list[str]:
+    """Só Cliente, Bases e Valor."""
+    dfc = _header_frame(header)
+    wanted = {_resolve_budget_col(dfc, spec) for spec in (CON_CLIENTE, CON_BASE, CON_VALOR)}
+    return [c for c in header if c in wanted]
+
+def contract_dtypes(header) -> dict:
+    col = _resolve_budget_col(_header_frame(header), CON_VALOR)
+    return {col: "numeric"} if col else {}
+
+def _revenue_bands(fat: pd.Series) -> pd.Series:
+    """Quartis do faturamento contratado, com rótulos em R$ (numerados para ordenar)."""
+    if fat.empty:
+        return pd.Series(dtype=str, index=fat.index)
+    edges = np.unique(np.quantile(fat, [0, 0.25, 0.5, 0.75, 1]))
+    if len(edges) < 2:
+        return pd.Series(f"1. {money(edges[0])}", index=fat.index)
+    codes = np.searchsorted(edges[1:-1], fat.to_numpy(), side="right")
+    labels = [f"{i + 1}. {money(lo)} – {money(hi)}" for i, (lo, hi) in enumerate(zip(edges[:-1], edges[1:]))]
+    return pd.Series(np.asarray(labels, dtype=object)[codes], index=fat.index)
+
+def contract_attributes(lines: pd.DataFrame, cost_cols) -> pd.DataFrame:
+    """Atributos de cada contrato (uma linha por chave) a partir das linhas da DRE contratada."""
+    attrs = pd.DataFrame(index=lines.index)
+    attrs["Faixa de faturamento"] = _revenue_bands(lines["FAT BRUTO"])
+    bins, labels = MARGIN_BANDS
+    bands = pd.cut(lines["MC%"], bins, labels=labels, right=False).astype(str)
+    attrs["Faixa de margem"] = bands.where(lines["FAT BRUTO"] > 0, "—")  # sem faturamento contratado
+    costs = lines[list(cost_cols)]
+    attrs["Maior custo"] = costs.idxmax(axis=1).where(costs.max(axis=1) > 0, "—") if cost_cols else "—"
+    return attrs
+
+@dataclass
+class ContractData:
+    """
+    Contratos com o valor mensal contratado por linha da DRE.
+
+    A chave do contrato é o Cliente em str (a mesma de EMPRESA na base);
+    `positions` é o índice hash chave -> linhas de `df`, `totals` tem uma
+    linha por contrato e `attrs` os atributos derivados dela.
+    """
+    df: pd.DataFrame
+    sheet: str
+    col_cliente: str
+    col_fat: str | None
+    col_ded: str | None
+    cost_cols: list[str]
+    totals: pd.DataFrame
+    attrs: pd.DataFrame
+    positions: dict = field(repr=False)
+
+    def lines(self) -> pd.DataFrame:
+        """Linhas da DRE contratada por contrato (FAT BRUTO, ..., MC, MC%)."""
+        return dre_lines(self.totals, self.col_fat, self.col_ded, self.cost_cols)
+
+    def contract_of(self, cliente) -> str | None:
+        key = str(cliente)
+        return key if key in self.positions else None
+
+def build_contracts(dfc: pd.DataFrame, sheet: str) -> ContractData:
+    col_cliente = _resolve_budget_col(dfc, CON_CLIENTE, fallback_first=True)
+    col_base = _resolve_budget_col(dfc, CON_BASE)
+    col_valor = _resolve_budget_col(dfc, CON_VALOR)
+    if not (col_base and col_valor):
+        raise ValueError(f"Aba '{sheet}': colunas 'Bases' e 'Valor' não encontradas.")
+
+    dfc = dfc[dfc[col_cliente].notna()].reset_index(drop=True)
+    keys = dfc[col_cliente].astype(str)
+    linhas = dfc[col_base].astype(str).str.strip().str.lower().map(_CONTRACT_LINE_OF)
+    valores = pd.to_numeric(dfc[col_valor], errors="coerce").fillna(0.0)
+    known = linhas.notna()
+    # Blocos repetidos do mesmo cliente somam; Bases fora da DRE são ignoradas
+    totals = valores[known].groupby([keys[known], linhas[known]], sort=False).sum().unstack(fill_value=0.0)
+    totals = totals.reindex(index=keys.drop_duplicates(), fill_value=0.0)
+    totals = totals[[c for c in CONTRACT_LINES if c in totals.columns]].rename_axis(index=CONTRACT_GROUP, columns=None)
+
+    col_fat, col_ded = (c if c in totals.columns else None for c in CONTRACT_LINES[:2])
+    cost_cols = [c for c in CONTRACT_LINES[2:] if c in totals.columns]
+    attrs = contract_attributes(dre_lines(totals, col_fat, col_ded, cost_cols), cost_cols)
+    positions = {k: np.asarray(v) for k, v in keys.groupby(keys, sort=False).indices.items()}
+    return ContractData(dfc, sheet, col_cliente, col_fat, col_ded, cost_cols, totals, attrs, positions)
+
+def regroup_lines(lines: pd.DataFrame, keys, names) -> pd.DataFrame:
+    """Linhas da DRE somadas por outra chave; MC% (a única não aditiva) é recalculada."""
+    out = lines.drop(columns="MC%").groupby(keys, sort=True).sum()
+    out.index.names = names
+    denom = out["FAT BRUTO"].where(out["FAT BRUTO"] != 0)
+    out["MC%"] = (out["MC"] / denom).fillna(0.0)
+    return out
+
+@dataclass
+class ContractCube:
+    """
+    Realizado do cubo (período × EMPRESA) ligado aos contratos: linhas da
+    DRE por (período, contrato) e por (período, valor de cada atributo).
+    Clientes sem contrato ficam em NO_CONTRACT.
+    """
+    groups: dict
+
+    def period_slice(self, group: str, periodo) -> pd.DataFrame:
+        """Uma linha por contrato (ou valor de atributo) no período."""
+        frame = self.groups[group]
+        try:
+            return frame.xs(periodo, level=0)
+        except KeyError:
+            return frame.iloc[0:0].droplevel(0)
+
+    def get(self, group: str, key, periodo) -> pd.Series:
+        frame = self.groups[group]
+        try:
+            return frame.loc[(periodo, key)]
+        except KeyError:
+            return pd.Series(0.0, index=frame.columns)
+
+def build_contract_cube(cube: DreCube, contracts: ContractData) -> ContractCube:
+    """
+    Junção feita uma vez por versão da base e dos contratos, sobre o cubo
+    já agregado: cada cliente distinto é procurado no índice de contratos
+    e as linhas (período, cliente) são reagrupadas, sem reler a base.
+    """
+    periodos = cube.by_client.index.get_level_values(0)
+    clientes = cube.by_client.index.get_level_values(1)
+    uniq = clientes.unique()
+    contrato = pd.Series([contracts.contract_of(c) or NO_CONTRACT for c in uniq], index=uniq)
+    groups = {CONTRACT_GROUP: regroup_lines(cube.by_client, [periodos, contrato.reindex(clientes).to_numpy()],
+                                            ["PERIODO", CONTRACT_GROUP])}
+    for attr in CONTRACT_ATTRS:
+        value = contrato.map(contracts.attrs[attr]).fillna(NO_CONTRACT)
+        groups[attr] = regroup_lines(cube.by_client, [periodos, value.reindex(clientes).to_numpy()], ["PERIODO", attr])
+    return ContractCube(groups)
@@ -0,0 +1,463 @@
+"""
+Leitura das planilhas (BD.xlsx, BD CONT NOVO.xlsx) com cache colunar em disco.
+
+O parse via openpyxl é a etapa mais lenta do app. Aqui cada aba é lida em
+streaming (openpyxl read-only, em lotes), só com as colunas usadas, e
+normalizada uma única vez (nomes de coluna sem espaços nas pontas, MÊS REF
+como datetime e PERIODO_LABEL) e gravada em Parquet num diretório
+`.dre_cache/` ao lado da planilha. O cache é indexado pelo SHA-256 e pelo
+mtime do arquivo: planilha inalterada carrega direto do Parquet; planilha
+alterada reconstrói o cache uma vez.
+"""
+import glob
+import hashlib
+import json
+import os
+import pickle
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+CACHE_DIR_NAME = ".dre_cache"
+# Incrementar quando a normalização mudar, para invalidar caches antigos
+CACHE_VERSION = 2
+# Linhas lidas por lote na leitura em streaming
+CHUNK_ROWS = 5000
+# Linhas por row group quando a aba vai direto para Parquet (write_sheet_parquet)
+PARQUET_CHUNK_ROWS = 50_000
+
+PT_MONTHS = ["janeiro","fevereiro","março","abril","maio","junho",
+             "julho","agosto","setembro","outubro","novembro","dezembro"]
+
+def month_label(dt: pd.Timestamp) -> str:
+    if pd.isna(dt):
+        return ""
+    m = PT_MONTHS[int(dt.month) - 1]
+    return f"{m}/{int(dt.year) % 100:02d}"
+
+# -----------------------------
+# Identidade do arquivo
+# -----------------------------
+def file_signature(path) -> tuple[int, int]:
+    """(mtime_ns, tamanho) – barato, usado como chave dos caches em memória."""
+    st_ = os.stat(path)
+    return st_.st_mtime_ns, st_.st_size
+
+def file_sha256(path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# -----------------------------
+# Leitura direta (sem cache)
+# -----------------------------
+def resolve_sheet(sheet_names, preferred_sheet: str | None = None, prefix: str | None = None) -> str:
+    """
+    Escolhe a aba: nome exato (case-insensitive) em `preferred_sheet`,
+    ou a primeira que começa com `prefix`; senão, a primeira aba.
+    """
+    names = [str(s) for s in sheet_names]
+    for s in names:
+        if preferred_sheet is not None and s.strip().lower() == preferred_sheet.lower():
+            return s
+        if prefix is not None and s.strip().upper().startswith(prefix.upper()):
+            return s
+    return names[0]
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    df.columns = [str(c).strip() for c in df.columns]
+    # Padroniza MÊS REF
+    if "MÊS REF" in df.columns:
+        df["MÊS REF"] = pd.to_datetime(df["MÊS REF"], errors="coerce")
+        # Um rótulo por mês distinto, não por linha
+        uniq = df["MÊS REF"].dropna().unique()
+        labels = pd.Series([month_label(p) for p in uniq], index=uniq, dtype=object)
+        df["PERIODO_LABEL"] = df["MÊS REF"].map(labels).fillna("").astype(object)
+    return df
+
+def _coerce_chunk(values: list, kind: str):
+    if kind == "numeric":
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=float)
+    if kind == "datetime":
+        return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy()
+    return pd.Series(values).to_numpy()
+
+def _open_sheet(path, preferred_sheet, prefix, usecols, dtypes):
+    """
+    Abre a aba em modo read-only do openpyxl: (workbook, aba, cabeçalho,
+    {coluna: posição}, {coluna: tipo}, iterador das linhas de dados).
+    O chamador fecha o workbook.
+    """
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        target = resolve_sheet(wb.sheetnames, preferred_sheet, prefix)
+        rows = wb[target].iter_rows(values_only=True)
+        header = next(rows, None) or ()
+    except Exception:
+        wb.close()
+        raise
+    names = [str(c).strip() if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+    keep = list(usecols(names)) if usecols else names
+    # Primeira ocorrência de cada nome (pandas renomearia duplicadas)
+    positions = {n: names.index(n) for n in keep if n in names}
+    plan = dtypes(names) if dtypes else {}
+    kinds = {n: plan.get(n) for n in positions}
+    return wb, target, header, positions, kinds, rows
+
+def _sheet_chunks(rows, positions: dict, kinds: dict, chunk_rows: int):
+    """Lotes de até `chunk_rows` linhas: {coluna: array já no tipo final}."""
+    buffer = {n: [] for n in positions}
+    filled = 0
+    for row in rows:
+        if not any(v is not None for v in row):
+            continue  # linha totalmente vazia: não entra em nenhuma conta
+        width = len(row)
+        for n, i in positions.items():
+            buffer[n].append(row[i] if i < width else None)
+        filled += 1
+        if filled == chunk_rows:
+            yield {n: _coerce_chunk(buffer[n], kinds[n]) for n in positions}
+            buffer = {n: [] for n in positions}
+            filled = 0
+    if filled:
+        yield {n: _coerce_chunk(buffer[n], kinds[n]) for n in positions}
+
+def _unnamed_tail(header, columns, is_empty) -> list[str]:
+    """Como o read_excel: colunas sem título e sem dados no fim da aba não entram."""
+    unnamed = {f"Unnamed: {i}" for i, c in enumerate(header) if c is None}
+    drop = []
+    for c in reversed(list(columns)):
+        if c not in unnamed or not is_empty(c):
+            break
+        drop.append(c)
+    return drop
+
+def stream_sheet(path, preferred_sheet: str | None = None, prefix: str | None = None,
+                 usecols=None, dtypes=None, chunk_rows: int = CHUNK_ROWS):
+    """
+    Lê a aba em modo read-only do openpyxl, em lotes de `chunk_rows` linhas.
+
+    `usecols(header) -> list[str]` escolhe as colunas (cabeçalho já sem
+    espaços nas pontas); as demais são descartadas antes de virar objeto
+    Python. `dtypes(header) -> {coluna: "numeric" | "datetime"}` converte
+    cada lote direto para o tipo final, então o pico de memória fica limitado a
+    um lote de objetos + as colunas já tipadas.
+    """
+    wb, target, header, positions, kinds, rows = _open_sheet(path, preferred_sheet, prefix, usecols, dtypes)
+    try:
+        parts = {n: [] for n in positions}
+        for chunk in _sheet_chunks(rows, positions, kinds, chunk_rows):
+            for n in positions:
+                parts[n].append(chunk[n])
+    finally:
+        wb.close()
+
+    data = {}
+    for n in positions:
+        chunks = parts[n]
+        if not chunks:
+            data[n] = np.array([], dtype=float if kinds[n] == "numeric" else object)
+        elif kinds[n] is None:
+            # Texto/misto: deixa o pandas inferir o tipo da coluna inteira
+            data[n] = pd.Series(np.concatenate([np.asarray(c, dtype=object) for c in chunks])).infer_objects()
+        else:
+            data[n] = np.concatenate(chunks)
+    df = pd.DataFrame(data, columns=list(positions))
+    df = df.drop(columns=_unnamed_tail(header, df.columns, lambda c: df[c].isna().all()))
+    return normalize_frame(df), target.strip()
+
+def _chunk_table(chunk: dict, kinds: dict) -> pa.Table:
+    """Lote -> tabela Arrow com os mesmos tipos do cache gravado a partir do pandas (normalize_frame)."""
+    arrays = {}
+    for n, values in chunk.items():
+        if n == "MÊS REF" and kinds[n] != "datetime":
+            values = _coerce_chunk(list(values), "datetime")
+        if kinds[n] is None and n != "MÊS REF":
+            # Sem tipo no plano: texto (o tipo não pode variar de um lote para outro)
+            values = [None if v is None or v != v else str(v) for v in values]
+            arrays[n] = pa.array(values, type=pa.large_string())
+        else:
+            arrays[n] = pa.array(values, from_pandas=True)
+    if "MÊS REF" in chunk:
+        mes = pd.Series(pd.to_datetime(arrays["MÊS REF"].to_pandas(), errors="coerce"))
+        uniq = mes.dropna().unique()
+        labels = pd.Series([month_label(p) for p in uniq], index=uniq, dtype=object)
+        arrays["PERIODO_LABEL"] = pa.array(mes.map(labels).fillna("").astype(object).tolist(), type=pa.string())
+    return pa.table(arrays)
+
+def write_sheet_parquet(path, out_path, preferred_sheet: str | None = None, prefix: str | None = None,
+                        usecols=None, dtypes=None, chunk_rows: int = PARQUET_CHUNK_ROWS) -> str:
+    """
+    Mesma leitura de `stream_sheet`, mas cada lote vai direto para um row
+    group do Parquet (ParquetWriter): a aba inteira nunca fica em memória.
+    Colunas sem tipo no plano são gravadas como texto. Devolve a aba lida.
+    """
+    out_path = Path(out_path)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    wb, target, header, positions, kinds, rows = _open_sheet(path, preferred_sheet, prefix, usecols, dtypes)
+    writer = None
+    filled = {n: False for n in positions}
+    try:
+        for chunk in _sheet_chunks(rows, positions, kinds, chunk_rows):
+            table = _chunk_table(chunk, kinds)
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, table.schema)
+            writer.write_table(table.cast(writer.schema))
+            for n in positions:
+                filled[n] = filled[n] or table.column(n).null_count < len(table)
+        if writer is None:
+            empty = {n: np.array([], dtype=float if kinds[n] == "numeric" else object) for n in positions}
+            table = _chunk_table(empty, kinds)
+            writer = pq.ParquetWriter(tmp, table.schema)
+            writer.write_table(table)
+    finally:
+        wb.close()
+        if writer is not None:
+            writer.close()
+
+    drop = _unnamed_tail(header, positions, lambda c: not filled[c])
+    if drop:
+        # Colunas vazias no fim só são conhecidas depois do último lote: regrava sem elas, por row group
+        src = pq.ParquetFile(tmp)
+        keep = [c for c in src.schema_arrow.names if c not in drop]
+        with pq.ParquetWriter(out_path, pa.schema([src.schema_arrow.field(c) for c in keep])) as writer:
+            for i in range(src.num_row_groups):
+                writer.write_table(src.read_row_group(i, columns=keep))
+        tmp.unlink()
+    else:
+        os.replace(tmp, out_path)
+    return target.strip()
+
+def read_workbook(path, preferred_sheet: str | None = None, prefix: str | None = None,
+                  usecols=None, dtypes=None):
+    return stream_sheet(path, preferred_sheet, prefix, usecols=usecols, dtypes=dtypes)
+
+# -----------------------------
+# Cache colunar (Parquet)
+# -----------------------------
+def _cache_paths(path: Path, preferred_sheet, prefix, plan_key, cache_dir):
+    base = Path(cache_dir) if cache_dir else path.parent / CACHE_DIR_NAME
+    spec = f"{preferred_sheet or ''}|{prefix or ''}|{plan_key or ''}"
+    key = hashlib.sha1(spec.encode("utf-8")).hexdigest()[:8]
+    stem = f"{path.name}.{key}"
+    return base, base / f"{stem}.json", stem
+
+def _read_manifest(manifest_path: Path):
+    try:
+        with open(manifest_path, encoding="utf-8") as fh:
+            meta = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if meta.get("version") != CACHE_VERSION:
+        return None
+    return meta
+
+def load_cached(path, preferred_sheet: str | None = None, prefix: str | None = None,
+                usecols=None, dtypes=None, plan_key: str = "", cache_dir=None):
+    """
+    Mesmo retorno de `read_workbook` (df normalizado, aba), servido do
+    Parquet quando o conteúdo da planilha não mudou. `plan_key` identifica
+    o plano de colunas/tipos (`usecols`/`dtypes`) e entra na chave do cache.
+
+    Falhas de escrita do cache (disco somente-leitura, coluna com tipos
+    mistos que o Arrow não serializa) não interrompem a leitura.
+    """
+    path = Path(path)
+    base, manifest_path, stem = _cache_paths(path, preferred_sheet, prefix, plan_key, cache_dir)
+    mtime_ns, size = file_signature(path)
+    meta = _read_manifest(manifest_path)
+
+    sha = None
+    if meta is not None and (meta.get("mtime_ns"), meta.get("size")) != (mtime_ns, size):
+        # mtime/tamanho mudaram: só o hash decide se o conteúdo mudou
+        sha = file_sha256(path)
+        if sha != meta.get("sha256"):
+            meta = None
+    if meta is not None:
+        try:
+            df = pd.read_parquet(base / meta["parquet"])
+        except Exception:
+            meta = None
+        else:
+            if sha is not None:
+                # Conteúdo igual com mtime novo (ex.: arquivo copiado): atualiza o manifesto
+                meta.update(mtime_ns=mtime_ns, size=size)
+                _write_manifest(manifest_path, meta)
+            return df, meta["sheet"]
+
+    df, target = read_workbook(path, preferred_sheet, prefix, usecols=usecols, dtypes=dtypes)
+    sha = sha or file_sha256(path)
+    parquet_name = f"{stem}.{sha[:16]}.parquet"
+    try:
+        base.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(base / parquet_name, index=False)
+    except Exception:
+        return df, target
+    _publish(path, base, manifest_path, parquet_name, target, sha, mtime_ns, size)
+    return df, target
+
+def _publish(path: Path, base: Path, manifest_path: Path, parquet_name: str, target: str,
+             sha: str, mtime_ns: int, size: int):
+    """Aponta o manifesto para o Parquet novo e apaga o anterior."""
+    old = _read_manifest(manifest_path)
+    if old and old.get("parquet") != parquet_name:
+        (base / old["parquet"]).unlink(missing_ok=True)
+    _write_manifest(manifest_path, {
+        "version": CACHE_VERSION,
+        "source": path.name,
+        "sheet": target,
+        "sha256": sha,
+        "mtime_ns": mtime_ns,
+        "size": size,
+        "parquet": parquet_name,
+    })
+
+def _write_manifest(manifest_path: Path, meta: dict):
+    tmp = manifest_path.with_suffix(".json.tmp")
+    try:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(meta, fh, ensure_ascii=False, indent=1)
+        os.replace(tmp, manifest_path)
+    except OSError:
+        pass
+
+def is_cached(path, preferred_sheet: str | None = None, prefix: str | None = None,
+              plan_key: str = "", cache_dir=None) -> bool:
+    """True se `load_cached` vai servir o arquivo do Parquet sem reabrir a planilha."""
+    path = Path(path)
+    base, manifest_path, _ = _cache_paths(path, preferred_sheet, prefix, plan_key, cache_dir)
+    meta = _read_manifest(manifest_path)
+    return (meta is not None
+            and (meta.get("mtime_ns"), meta.get("size")) == file_signature(path)
+            and (base / meta["parquet"]).exists())
+
+def cached_parquet(path, preferred_sheet: str | None = None, prefix: str | None = None,
+                   usecols=None, dtypes=None, plan_key: str = "", cache_dir=None) -> tuple[Path | None, str]:
+    """
+    (arquivo Parquet do cache, aba) da planilha, gravando-o antes se o cache
+    estiver desatualizado – para consultas direto no Parquet (dre_sql).
+    A gravação é em lotes (`write_sheet_parquet`): a planilha nunca vira um
+    DataFrame inteiro. Parquet None quando o cache não pôde ser gravado.
+    """
+    path = Path(path)
+    base, manifest_path, stem = _cache_paths(path, preferred_sheet, prefix, plan_key, cache_dir)
+    if not is_cached(path, preferred_sheet, prefix, plan_key, cache_dir):
+        mtime_ns, size = file_signature(path)
+        sha = file_sha256(path)
+        meta = _read_manifest(manifest_path)
+        if meta is not None and meta.get("sha256") == sha and (base / meta["parquet"]).exists():
+            # Conteúdo igual com mtime novo (ex.: arquivo copiado): atualiza o manifesto
+            meta.update(mtime_ns=mtime_ns, size=size)
+            _write_manifest(manifest_path, meta)
+        else:
+            parquet_name = f"{stem}.{sha[:16]}.parquet"
+            try:
+                base.mkdir(parents=True, exist_ok=True)
+            except OSError:
+                return None, ""
+            try:
+                target = write_sheet_parquet(path, base / parquet_name, preferred_sheet, prefix,
+                                             usecols=usecols, dtypes=dtypes)
+            except (OSError, pa.ArrowException):
+                return None, ""
+            _publish(path, base, manifest_path, parquet_name, target, sha, mtime_ns, size)
+            if not is_cached(path, preferred_sheet, prefix, plan_key, cache_dir):
+                return None, target
+    meta = _read_manifest(manifest_path)
+    return base / meta["parquet"], meta["sheet"]
+
+# -----------------------------
+# Várias planilhas (uma por mês / unidade)
+# -----------------------------
+def expand_sources(spec) -> list[Path]:
+    """
+    Arquivo único, diretório (todos os .xlsx dentro) ou glob
+    ("BD/*.xlsx"). Ignora os arquivos temporários "~$" do Excel.
+    """
+    spec = str(spec)
+    p = Path(spec)
+    if p.is_dir():
+        paths = p.glob("*.xlsx")
+    elif any(ch in spec for ch in "*?["):
+        paths = (Path(x) for x in glob.glob(spec))
+    else:
+        return [p] if p.exists() else []
+    return sorted(x for x in paths if x.is_file() and not x.name.startswith("~$"))
+
+def sources_signature(paths) -> tuple:
+    """Assinatura do conjunto de arquivos: muda quando qualquer um muda, entra ou sai."""
+    return tuple((str(p), *file_signature(p)) for p in paths)
+
+def _load_one(args):
+    path, preferred_sheet, prefix, usecols, dtypes, plan_key, cache_dir = args
+    return load_cached(path, preferred_sheet, prefix, usecols=usecols, dtypes=dtypes,
+                       plan_key=plan_key, cache_dir=cache_dir)
+
+def _worker_main():
+    """Entrada dos processos de leitura (`python -m dre_io`): jobs em pickle no stdin, cada um vira cache Parquet."""
+    for job in pickle.load(sys.stdin.buffer):
+        try:
+            _load_one(job)
+        except Exception:
+            pass  # o processo principal relê o arquivo e mostra o erro
+
+def _build_caches(jobs, workers: int):
+    """
+    Grava o cache Parquet de cada job em `workers` processos e espera todos.
+
+    Os processos são interpretadores novos rodando `python -m dre_io`, fora do
+    multiprocessing: com spawn ele reexecuta o __main__ do pai (sob o
+    Streamlit, o próprio app). O resultado volta pelo cache em disco.
+    """
+    here = str(Path(__file__).resolve().parent)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [here, os.environ.get("PYTHONPATH")])))
+    procs = []
+    for k in range(workers):
+        batch = [(Path(job[0]).resolve(), *job[1:]) for job in jobs[k::workers]]
+        proc = subprocess.Popen([sys.executable, "-m", "dre_io"], stdin=subprocess.PIPE, env=env)
+        proc.stdin.write(pickle.dumps(batch))
+        proc.stdin.close()
+        procs.append(proc)
+    for proc in procs:
+        proc.wait()
+
+def load_sources(paths, preferred_sheet: str | None = None, prefix: str | None = None,
+                 usecols=None, dtypes=None, plan_key: str = "", canonicalize=None,
+                 cache_dir=None, max_workers: int | None = None):
+    """
+    Lê várias planilhas e concatena num único frame normalizado.
+
+    Cada arquivo tem seu próprio cache Parquet: só os que mudaram (ou são
+    novos) são abertos, em paralelo em processos separados – o parse do
+    openpyxl é CPU-bound e não escala com threads. `canonicalize(df)`
+    reconcilia os aliases de coluna de cada arquivo antes da concatenação.
+    `usecols`/`dtypes`/`canonicalize` precisam ser funções de módulo
+    (são enviadas aos processos).
+
+    Retorna (df, abas), com `abas` na ordem de `paths`.
+    """
+    paths = [Path(p) for p in paths]
+    jobs = [(p, preferred_sheet, prefix, usecols, dtypes, plan_key, cache_dir) for p in paths]
+    misses = [i for i, p in enumerate(paths) if not is_cached(p, preferred_sheet, prefix, plan_key, cache_dir)]
+
+    if len(misses) > 1 and (max_workers is None or max_workers > 1):
+        _build_caches([jobs[i] for i in misses], min(len(misses), max_workers or os.cpu_count() or 1))
+    # Com os caches prontos cada leitura é um Parquet; o que falhou nos processos é lido (e acusado) aqui
+    results = [_load_one(job) for job in jobs]
+
+    frames = [canonicalize(df) if canonicalize else df for df, _ in results]
+    if not frames:
+        return pd.DataFrame(), []
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True, sort=False)
+    return df, [sheet for _, sheet in results]
+
+if __name__ == "__main__":
+    _worker_main()
@@ -0,0 +1,127 @@
+"""
+Instrumentação das execuções do app (cada rerun do Streamlit).
+
+Tempo por etapa – load, schema, filter, aggregate, format, render –,
+status dos caches (hit/miss), registro estruturado em JSON Lines para
+análise offline e captura opcional com cProfile. Sem dependência do
+Streamlit: o app cria um RerunTimer no início de cada execução.
+"""
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from pathlib import Path
+
+STAGES = ["load", "schema", "filter", "aggregate", "format", "render"]
+
+class RerunTimer:
+    """
+    Acumula o tempo próprio de cada etapa: uma etapa aberta dentro de outra
+    (ex.: format dentro de render) pausa a de fora, então a soma das etapas
+    nunca passa do total da execução. Só a thread que criou o timer é
+    medida: chamadas vindas do aquecimento em segundo plano (dre_warm)
+    são ignoradas.
+    """
+    def __init__(self):
+        self._owner = threading.get_ident()
+        self.started = time.perf_counter()
+        self.times = dict.fromkeys(STAGES, 0.0)
+        self.caches = {}
+        self._stack = []
+        self._mark = self.started
+
+    def _flush(self):
+        now = time.perf_counter()
+        if self._stack:
+            name = self._stack[-1]
+            self.times[name] = self.times.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    def _foreign(self) -> bool:
+        return threading.get_ident() != self._owner
+
+    def begin(self, name: str):
+        if self._foreign():
+            return
+        self._flush()
+        self._stack.append(name)
+
+    def end(self):
+        if self._foreign():
+            return
+        self._flush()
+        if self._stack:
+            self._stack.pop()
+
+    @contextmanager
+    def stage(self, name: str):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def timed(self, name: str, fn):
+        """`fn` com cada chamada contada na etapa `name`."""
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    # Cache: hit() antes de chamar a função cacheada; o corpo dela chama miss() quando executa
+    def hit(self, name: str):
+        if not self._foreign():
+            self.caches[name] = "hit"
+
+    def miss(self, name: str, **detail):
+        if not self._foreign():
+            self.caches[name] = {"status": "miss", **detail} if detail else "miss"
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def record(self, **context) -> dict:
+        """Registro da execução (fecha as etapas ainda abertas)."""
+        while self._stack:
+            self.end()
+        total = self.total()
+        stages = {k: round(v, 6) for k, v in self.times.items()}
+        stages["outros"] = round(max(total - sum(self.times.values()), 0.0), 6)
+        return {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "total_s": round(total, 6),
+            "stages": stages,
+            "caches": dict(self.caches),
+            **context,
+        }
+
+def append_log(path, record: dict):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+# -----------------------------
+# cProfile (uma execução)
+# -----------------------------
+def start_profile() -> cProfile.Profile:
+    prof = cProfile.Profile()
+    prof.enable()
+    return prof
+
+def finish_profile(prof: cProfile.Profile, out_path=None, top: int = 30) -> str:
+    """Encerra a captura, grava o .prof (abre no snakeviz/pstats) e devolve o top por tempo acumulado."""
+    prof.disable()
+    if out_path is not None:
+        out_path = Path(out_path)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        prof.dump_stats(out_path)
+    buf = io.StringIO()
+    pstats.Stats(prof, stream=buf).strip_dirs().sort_stats("cumulative").print_stats(top)
+    return buf.getvalue()
@@ -0,0 +1,168 @@
+"""
+Backend SQL opcional (DuckDB) para históricos grandes.
+
+    pip install duckdb
+    python dre_batch.py --bd "BD/*.xlsx" --backend duckdb
+    python dre_batch.py --verificar          # pandas x DuckDB, mesmas tabelas
+
+As agregações rodam direto nos Parquet de `.dre_cache/` (um por planilha):
+o DuckDB lê só as colunas usadas e agrega fora da memória (spill em disco
+quando passa de `memory_limit`), e só as somas por (período, cliente)
+voltam para o pandas. As linhas da DRE, rankings e Orçado x Realizado
+saem das mesmas funções do dre_core, então os dois backends entregam as
+mesmas tabelas. O pandas continua sendo o padrão (no app, opt-in com
+DRE_BACKEND=duckdb).
+"""
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from dre_core import (BD_PLAN_KEY, CENTS, DreCube, DreSchema, bd_dtypes, bd_usecols, bd_value_cols, canonicalize_bd,
+                      dre_lines, resolve_real_cols, resolve_schema)
+from dre_io import cached_parquet
+
+def _ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _literal(text: str) -> str:
+    """Texto como literal SQL (caminhos com apóstrofo, ex.: D'Ávila/)."""
+    return "'" + str(text).replace("'", "''") + "'"
+
+def _connect(database: str, memory_limit: str | None, threads: int | None):
+    try:
+        import duckdb
+    except ImportError as exc:
+        raise RuntimeError("Backend 'duckdb' indisponível: instale com `pip install duckdb`.") from exc
+    con = duckdb.connect(database)
+    if memory_limit:
+        con.execute(f"SET memory_limit = {_literal(memory_limit)}")
+    if threads:
+        con.execute(f"SET threads = {int(threads)}")
+    return con
+
+class SqlBackend:
+    """
+    View `bd` sobre os Parquet das planilhas, com os aliases de coluna de
+    cada arquivo já renomeados (mesma regra de `canonicalize_bd`).
+    Cada consulta abre um cursor próprio: a mesma instância atende as
+    threads do servidor e as do aquecimento.
+    """
+    def __init__(self, paths, preferred_sheet: str = "bd", cache_dir=None, database: str = ":memory:",
+                 memory_limit: str | None = None, threads: int | None = None):
+        self.con = _connect(database, memory_limit, threads)
+        selects, header, self.sheets = [], [], []
+        for path in paths:
+            parquet, sheet = cached_parquet(path, preferred_sheet, usecols=bd_usecols, dtypes=bd_dtypes,
+                                            plan_key=BD_PLAN_KEY, cache_dir=cache_dir)
+            if parquet is None:
+                raise RuntimeError(f"Sem cache Parquet para '{path}' (o backend SQL consulta o Parquet).")
+            self.sheets.append(sheet)
+            cols = pq.read_schema(parquet).names
+            renamed = canonicalize_bd(pd.DataFrame(columns=cols)).columns
+            selects.append(
+                "SELECT " + ", ".join(f"{_ident(a)} AS {_ident(b)}" for a, b in zip(cols, renamed))
+                + f" FROM read_parquet({_literal(Path(parquet).as_posix())})"
+            )
+            header += [c for c in renamed if c not in header]
+        if not selects:
+            raise FileNotFoundError("Nenhuma planilha para o backend SQL.")
+        self.con.execute("CREATE OR REPLACE VIEW bd AS " + " UNION ALL BY NAME ".join(selects))
+        self.header = header
+        self.schema: DreSchema = resolve_schema(pd.DataFrame(columns=header))
+        self.value_cols = bd_value_cols(header)
+        self._exact = None
+        self._rows = None
+
+    def _query(self, sql: str, params=None) -> pd.DataFrame:
+        with self.con.cursor() as cur:
+            return cur.execute(sql, params or []).df()
+
+    def exact_cols(self) -> set:
+        """
+        Colunas de valor só com centavos inteiros (`dre_core.cents_exact`
+        sobre a base inteira): essas somam em centavos, as demais em float,
+        como no `compact_bd`.
+        """
+        if self._exact is None:
+            checks = ", ".join(
+                f"COALESCE(BOOL_AND(ABS(s{i} - ROUND(s{i})) <= 1e-6 + 1e-12 * ABS(ROUND(s{i}))), TRUE) AS c{i}"
+                for i in range(len(self.value_cols))
+            )
+            scaled = ", ".join(
+                f"TRY_CAST({_ident(c)} AS DOUBLE) * {CENTS} AS s{i}" for i, c in enumerate(self.value_cols)
+            )
+            if not checks:
+                self._exact = set()
+            else:
+                row = self._query(f"SELECT {checks} FROM (SELECT {scaled} FROM bd)").iloc[0]
+                self._exact = {c for i, c in enumerate(self.value_cols) if bool(row[f"c{i}"])}
+        return self._exact
+
+    def row_count(self) -> int:
+        if self._rows is None:
+            self._rows = int(self._query("SELECT COUNT(*) AS n FROM bd")["n"].iloc[0])
+        return self._rows
+
+    def _period_expr(self) -> str:
+        if self.schema.has_mes_ref:
+            return _ident("MÊS REF")
+        return f"CAST({_ident(self.schema.col_periodo)} AS VARCHAR)"
+
+    def group_sums(self, cols):
+        """
+        Somas em R$ por (período, cliente) e por período, como em
+        `dre_core.group_lines`: colunas de centavos exatos arredondadas ao
+        centavo (meio para o par, igual ao numpy) e somadas como inteiro;
+        as demais somadas em float.
+        """
+        cols = list(cols)
+        exact = self.exact_cols()
+        per = self._period_expr()
+        emp = f"CAST({_ident(self.schema.col_empresa)} AS VARCHAR)"
+        values = ", ".join(
+            f"CAST(ROUND_EVEN(TRY_CAST({_ident(c)} AS DOUBLE) * {CENTS}, 0) AS BIGINT) AS {_ident(c)}" if c in exact
+            else f"TRY_CAST({_ident(c)} AS DOUBLE) AS {_ident(c)}"
+            for c in cols
+        )
+        sums = ", ".join(
+            f"CAST(SUM(COALESCE({_ident(c)}, 0)) AS {'BIGINT' if c in exact else 'DOUBLE'}) AS {_ident(c)}"
+            for c in cols
+        )
+        base = f"SELECT {per} AS PERIODO, {emp} AS EMPRESA, {values} FROM bd WHERE {per} IS NOT NULL"
+        by_client = self._query(
+            f"WITH b AS ({base}) SELECT PERIODO, EMPRESA, {sums} FROM b WHERE EMPRESA IS NOT NULL GROUP BY ALL"
+        )
+        total = self._query(f"WITH b AS ({base}) SELECT PERIODO, {sums} FROM b GROUP BY ALL")
+
+        by_client = by_client.rename(columns={"EMPRESA": self.schema.col_empresa})
+        by_client = by_client.set_index(["PERIODO", self.schema.col_empresa]).sort_index()
+        total = total.set_index("PERIODO").sort_index()
+
+        def reais(frame):
+            return frame[cols].astype(float).assign(**{c: frame[c].astype(float) / CENTS for c in cols if c in exact})
+        return reais(by_client), reais(total)
+
+    def group_lines(self, col_fat, col_ded, cost_cols):
+        cols = [c for c in [col_fat, col_ded] + list(cost_cols) if c]
+        by_client, total = self.group_sums(cols)
+        return dre_lines(by_client, col_fat, col_ded, cost_cols), dre_lines(total, col_fat, col_ded, cost_cols)
+
+    def build_cube(self) -> DreCube:
+        by_client, consolidated = self.group_lines(self.schema.col_fat, self.schema.col_ded, self.schema.cost_cols)
+        return DreCube(self.schema, by_client, consolidated)
+
+    def real_lines(self) -> pd.DataFrame:
+        """REALIZADO do Orçado x Realizado por (período, cliente)."""
+        by_client, _ = self.group_lines(*resolve_real_cols(pd.DataFrame(columns=self.header)))
+        return by_client
+
+    def rows(self, periodo, cliente=None) -> pd.DataFrame:
+        """Linhas brutas de um período (e cliente), como na base do pandas – para a conferência."""
+        per = self._period_expr()
+        where = f"{per} = ?"
+        params = [periodo if self.schema.has_mes_ref else str(periodo)]
+        if cliente is not None:
+            where += f" AND CAST({_ident(self.schema.col_empresa)} AS VARCHAR) = ?"
+            params.append(str(cliente))
+        return self._query(f"SELECT * FROM bd WHERE {where}", params)
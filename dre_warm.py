@@ -0,0 +1,80 @@
+"""
+Pré-cálculo em segundo plano (aquecimento de cache).
+
+Um pool de threads por processo executa as funções cacheadas do app antes
+que o usuário peça: no início, o último período (consolidado, rankings do
+Dashboard e DRE dos clientes que ele mostra); depois de cada seleção, os
+meses vizinhos e os clientes do topo do ranking. Quando a navegação chega
+lá, o cache já está quente. Sem dependência do Streamlit: as tarefas são as
+próprias funções cacheadas, e cada chave é enviada uma única vez (de novo
+só se falhar).
+"""
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class Prefetcher:
+    """
+    Fila de aquecimento com deduplicação por chave. Falhas não sobem: a
+    execução normal recalcula e mostra o erro no lugar certo, e a chave
+    pode ser enviada de novo. `max_workers=0` desliga (submit vira no-op).
+
+    O primeiro item da chave é a geração (a versão da base): só as chaves
+    das `generations` gerações usadas mais recentemente são lembradas.
+    """
+    def __init__(self, max_workers: int = 2, generations: int = 2):
+        self.pool = ThreadPoolExecutor(max_workers, thread_name_prefix="dre-warm") if max_workers > 0 else None
+        self.generations = generations
+        self._lock = threading.Lock()
+        self._seen = OrderedDict()  # geração -> chaves enviadas
+        self._running = 0
+        self.done = 0
+        self.failed = 0
+        self.last_error = None
+
+    def submit(self, key, fn, *args, **kwargs) -> bool:
+        """Agenda `fn(*args, **kwargs)` se `key` ainda não foi enviada; True quando agendou."""
+        if self.pool is None:
+            return False
+        with self._lock:
+            seen = self._seen.setdefault(key[0], set())
+            self._seen.move_to_end(key[0])
+            while len(self._seen) > self.generations:
+                self._seen.popitem(last=False)
+            if key in seen:
+                return False
+            seen.add(key)
+            self._running += 1
+        self.pool.submit(self._run, key, fn, args, kwargs)
+        return True
+
+    def _run(self, key, fn, args, kwargs):
+        try:
+            fn(*args, **kwargs)
+            ok, error = True, None
+        except Exception as exc:  # noqa: BLE001 – aquecimento é best-effort
+            ok, error = False, f"{type(exc).__name__}: {exc}"
+        with self._lock:
+            self._running -= 1
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+                self.last_error = error
+                self._seen.get(key[0], set()).discard(key)
+
+    def status(self) -> dict:
+        with self._lock:
+            return {"pendentes": self._running, "concluidas": self.done, "falhas": self.failed}
+
+def neighbours(items, item, radius: int = 1) -> list:
+    """Itens até `radius` posições antes/depois de `item` (o mais próximo primeiro)."""
+    items = list(items)
+    try:
+        pos = items.index(item)
+    except ValueError:
+        return []
+    out = []
+    for step in range(1, radius + 1):
+        out += [items[i] for i in (pos + step, pos - step) if 0 <= i < len(items)]
+    return out
@@ -1,150 +1,197 @@
 
+import os
+import time
+
 import streamlit as st
 import pandas as pd
 from pathlib import Path
 
+from dre_core import (BD_PLAN_KEY, BUDGET_PLAN_KEY, CONTRACT_ATTRS, CONTRACT_GROUP, CONTRACT_PLAN_KEY, VARIANCE_LINES,
+                      bd_dtypes, bd_usecols, block_lines, budget_comparison, budget_dtypes, budget_variance,
+                      build_budget, build_contract_cube, build_contracts, build_dre_cube, build_row_index,
+                      canonicalize_bd, changed_periods, compact_bd, contract_dtypes, contract_usecols, dre_statement,
+                      dre_trend, frame_memory, group_lines, money_series, perc_series, period_hashes, qa_page,
+                      qa_positions, rank_deviations, resolve_real_cols, resolve_schema, statement_table_html,
+                      update_dre_cube, update_real_lines, variance_matrix)
+from dre_io import (CACHE_DIR_NAME, expand_sources, file_signature, is_cached, load_cached, load_sources, month_label,
+                    sources_signature)
+from dre_perf import RerunTimer, append_log, finish_profile, start_profile
+from dre_warm import Prefetcher, neighbours
+
 st.set_page_config(page_title="DRE – Elicon", layout="wide")
 
+# -----------------------------
+# Diagnóstico: tempo por etapa desta execução (painel no fim da sidebar)
+# -----------------------------
+timer = RerunTimer()
+# DRE_PERF_LOG=<arquivo> liga o log por padrão; o painel permite ligar/desligar por sessão
+PERF_LOG_PATH = os.environ.get("DRE_PERF_LOG") or str(Path(CACHE_DIR_NAME) / "perf_log.jsonl")
+_stale_profiler = st.session_state.pop("perf_profiler", None)
+if _stale_profiler is not None:
+    _stale_profiler.disable()  # execução anterior interrompida por st.stop()
+profiler = None
+if st.session_state.pop("perf_profile_next", False):
+    profiler = start_profile()
+    st.session_state["perf_profiler"] = profiler
+
+# Formatação conta na etapa "format" onde quer que seja chamada
+money_series = timer.timed("format", money_series)
+perc_series = timer.timed("format", perc_series)
+
 # -----------------------------
 # Utilities
 # -----------------------------
-PT_MONTHS = ["janeiro","fevereiro","março","abril","maio","junho",
-             "julho","agosto","setembro","outubro","novembro","dezembro"]
-
-def month_label(dt: pd.Timestamp) -> str:
-    if pd.isna(dt):
-        return ""
-    m = PT_MONTHS[int(dt.month) - 1]
-    return f"{m}/{int(dt.year) % 100:02d}"
-
-@st.cache_data(show_spinner=False)
-def load_data(path: str, preferred_sheet: str = "bd"):
-    # Abre o arquivo e resolve a aba de forma resiliente
-    xls = pd.ExcelFile(path, engine="openpyxl")
-    sheetnames = [str(s).strip() for s in xls.sheet_names]
-    target = None
-    for s in sheetnames:
-        if s.lower() == preferred_sheet.lower():
-            target = s
-            break
-    if target is None:
-        target = sheetnames[0]
-    df = pd.read_excel(xls, sheet_name=target, engine="openpyxl")
-    df.columns = [str(c).strip() for c in df.columns]
-
-    # Padroniza MÊS REF
-    if "MÊS REF" in df.columns:
-        df["MÊS REF"] = pd.to_datetime(df["MÊS REF"], errors="coerce")
-        df["PERIODO_LABEL"] = df["MÊS REF"].apply(month_label)
-    return df, target
-
-def money(x):
-    try:
-        return f"R$ {float(x):,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
-    except Exception:
-        return "R$ 0,00"
-
-def perc(x):
-    try:
-        return (f"{float(x)*100:,.2f}%").replace(",", "X").replace(".", ",").replace("X", ".")
-    except Exception:
-        return "0,00%"
-
-def pct(dividend, divisor):
-    if divisor == 0:
-        return 0.0
-    return dividend / divisor
-
-def resolve_col(df: pd.DataFrame, candidates):
-    for c in candidates:
-        if c in df.columns:
-            return c
-    return None
-
-def resolve_col_ci(df: pd.DataFrame, targets: list[str], fallback_first: bool = True):
-    """
-    Resolve o nome de uma coluna de forma case-insensitive,
-    comparando contra aliases-alvo. Se não encontrar e fallback_first=True,
-    retorna a primeira coluna.
-    """
-    cols = list(df.columns)
-    lowered = {str(c): str(c).strip().lower() for c in cols}
-    target_norm = [t.strip().lower() for t in targets]
-    for cname, low in lowered.items():
-        if low in target_norm:
-            return cname
-    if fallback_first and cols:
-        return cols[0]
-    return None
+# Base, cubo e índices ficam em st.cache_resource: um único objeto por processo, entregue a todas as
+# sessões sem pickle/cópia. São somente-leitura: as visões só recortam (Copy-on-Write do pandas >= 3)
+# e nunca escrevem neles. Duas versões por função: a atual e a que sessões abertas ainda usam.
+SHARED = dict(show_spinner=False, max_entries=2)
+# DRE_BACKEND=duckdb: agregações no DuckDB direto dos Parquet de .dre_cache/ (dre_sql), sem a base inteira em memória
+USE_SQL = os.environ.get("DRE_BACKEND", "pandas").strip().lower() == "duckdb"
+
+@st.cache_resource(**SHARED)
+def load_data(path: str, preferred_sheet: str = "bd", signature=None):
+    # Abre o(s) arquivo(s) e resolve a aba de forma resiliente (cache Parquet por arquivo em .dre_cache/).
+    # Leitura em streaming, só com as colunas que a DRE usa, já tipadas; arquivos novos/alterados em paralelo.
+    paths = expand_sources(path)
+    parsed = sum(not is_cached(p, preferred_sheet, plan_key=BD_PLAN_KEY) for p in paths)
+    timer.miss("load_data", source="xlsx" if parsed else "parquet", files=len(paths), parsed=parsed)
+    df_, sheets = load_sources(paths, preferred_sheet=preferred_sheet, usecols=bd_usecols, dtypes=bd_dtypes,
+                               plan_key=BD_PLAN_KEY, canonicalize=canonicalize_bd)
+    # Versão compacta no cache: categorias, centavos inteiros, só colunas da DRE
+    mem_before = frame_memory(df_)
+    df_ = compact_bd(df_)
+    return df_, sheets, {"antes": mem_before, "depois": frame_memory(df_)}
+
+@st.cache_resource(**SHARED)
+def load_backend(path: str, preferred_sheet: str = "bd", signature=None):
+    # Só os caches Parquet (gravados em lotes) e a view do DuckDB; as linhas ficam em disco
+    paths = expand_sources(path)
+    parsed = sum(not is_cached(p, preferred_sheet, plan_key=BD_PLAN_KEY) for p in paths)
+    timer.miss("load_backend", source="xlsx" if parsed else "parquet", files=len(paths), parsed=parsed)
+    from dre_sql import SqlBackend
+    return SqlBackend(paths, preferred_sheet)
 
 # -----------------------------
 # Load
 # -----------------------------
-data_path = Path("BD.xlsx")
-if not data_path.exists():
-    st.error("Arquivo 'BD.xlsx' não encontrado no diretório do app. Faça o upload em 'Files' do Streamlit Cloud ou adicione ao repo.")
+# 'BD.xlsx' por padrão; DRE_BD_PATH aceita um diretório ou glob com uma planilha por mês/unidade (ex.: "BD/*.xlsx")
+data_spec = os.environ.get("DRE_BD_PATH", "BD.xlsx")
+timer.begin("load")
+data_files = expand_sources(data_spec)
+if not data_files:
+    st.error(f"Arquivo '{data_spec}' não encontrado no diretório do app. Faça o upload em 'Files' do Streamlit Cloud ou adicione ao repo.")
     st.stop()
+data_signature = sources_signature(data_files)
 
-df, resolved_sheet = load_data(str(data_path), preferred_sheet="bd")
+if USE_SQL:
+    timer.hit("load_backend")
+    backend = load_backend(data_spec, preferred_sheet="bd", signature=data_signature)
+    df, resolved_sheets, data_memory = None, backend.sheets, None
+else:
+    timer.hit("load_data")
+    df, resolved_sheets, data_memory = load_data(data_spec, preferred_sheet="bd", signature=data_signature)
+    backend = None
+resolved_sheet = ", ".join(dict.fromkeys(resolved_sheets))
+timer.end()
 
 # -----------------------------
-# Mapeamento de colunas (candidatos)
+# Mapeamento de colunas (candidatos em dre_core)
 # -----------------------------
-C_FAT = ["FAT MÊS $", "FAT MES $", "FAT_MES_$", "FAT_MES", "FAT"]
-E_DED = ["DEDUÇÕES LEGAIS", "DEDUCOES LEGAIS", "DEDUCOES", "DEDUÇÕES"]
-K_SAL = ["SALÁRIO", "SALARIO"]
-L_VT  = ["VALE TRANSPORTE", "VT"]
-M_VA  = ["VALE ALIMENTAÇÃO", "VALE ALIMENTACAO", "VA"]
-N_VR  = ["VALE REFEIÇÃO", "VALE REFEICAO", "VR"]
-O_ASS = ["ASSIDUIDADE"]
-S_ENC = ["TOTAL ENCARGOS", "ENCARGOS", "TOTAL_ENCARGOS"]
-AA_FT = ["FT"]
-AB_FR = ["FREELANCE"]
-U_RATEIO = ["RATEIO MP", "RATEIO_MP", "RATEIO"]
-MCOL = ["MATERIAL DE CONSUMO", "MATERIAL_CONSUMO", "MAT CONSUMO"]
-
-col_fat = resolve_col(df, C_FAT)
-col_ded = resolve_col(df, E_DED)
-col_sal = resolve_col(df, K_SAL)
-col_vt  = resolve_col(df, L_VT)
-col_va  = resolve_col(df, M_VA)
-col_vr  = resolve_col(df, N_VR)
-col_ass = resolve_col(df, O_ASS)
-col_enc = resolve_col(df, S_ENC)
-col_ft  = resolve_col(df, AA_FT)
-col_frl = resolve_col(df, AB_FR)
-col_rat = resolve_col(df, U_RATEIO)
-col_mco = resolve_col(df, MCOL)
-
-cost_cols = [c for c in [col_sal, col_vt, col_va, col_vr, col_ass, col_enc, col_ft, col_frl, col_rat, col_mco] if c is not None]
+with timer.stage("schema"):
+    schema = backend.schema if USE_SQL else resolve_schema(df)
+col_fat = schema.col_fat
+col_ded = schema.col_ded
+cost_cols = schema.cost_cols
+
+@st.cache_resource(show_spinner=False)
+def cube_store() -> dict:
+    # Último cubo de cada base com os hashes por período; sobrevive à troca de versão do arquivo
+    return {}
+
+@st.cache_resource(**SHARED)
+def load_period_hashes(path: str, signature=None) -> dict:
+    # Impressão digital de cada período desta versão: decide o que o cubo e o REALIZADO recalculam e
+    # é a chave dos caches por período (DRE pronta, ranking), que assim sobrevivem à troca de versão
+    timer.miss("load_period_hashes")
+    df_, _, _ = load_data(path, preferred_sheet="bd", signature=signature)
+    return period_hashes(df_, resolve_schema(df_))
+
+@st.cache_resource(**SHARED)
+def load_cube(path: str, signature=None):
+    # Cubo (período × EMPRESA) calculado uma vez por versão da base. Quando a planilha muda
+    # (ex.: entra o mês novo), só os períodos com conteúdo diferente são recalculados.
+    if USE_SQL:
+        timer.miss("load_cube", backend="duckdb")
+        return load_backend(path, signature=signature).build_cube()
+    df_, _, _ = load_data(path, preferred_sheet="bd", signature=signature)
+    schema_ = resolve_schema(df_)
+    hashes = load_period_hashes(path, signature=signature)
+    previous = cube_store().get(path)
+    if previous is None:
+        cube_ = build_dre_cube(df_, schema_)
+        timer.miss("load_cube", periodos=len(hashes))
+    else:
+        changed = changed_periods(previous[0], hashes)
+        cube_ = update_dre_cube(previous[1], df_, schema_, changed)
+        timer.miss("load_cube", periodos=len(changed))
+    cube_store()[path] = (hashes, cube_)
+    return cube_
+
+@st.cache_resource(**SHARED)
+def load_row_index(path: str, signature=None):
+    # Posições das linhas por (período, cliente), para as bases de QA; só montado quando uma delas é aberta
+    timer.miss("load_row_index")
+    df_, _, _ = load_data(path, preferred_sheet="bd", signature=signature)
+    return build_row_index(df_, resolve_schema(df_))
+
+timer.hit("load_cube")
+if not USE_SQL:
+    timer.hit("load_period_hashes")
+with timer.stage("aggregate"):
+    cube = load_cube(data_spec, signature=data_signature)
+    period_versions = None if USE_SQL else load_period_hashes(data_spec, signature=data_signature)
+
+def period_version(periodo):
+    # No DuckDB não há hashes por período: a versão de cada período é a da base inteira
+    return data_signature if period_versions is None else period_versions.get(periodo)
 
 # -----------------------------
 # Sidebar (Filtros)
 # -----------------------------
 st.sidebar.header("Parâmetros")
-st.sidebar.caption(f"Aba carregada: **{resolved_sheet}**")
+st.sidebar.caption(f"Aba carregada: **{resolved_sheet}**" + (f" ({len(data_files)} arquivos)" if len(data_files) > 1 else ""))
 
-col_empresa = "EMPRESA" if "EMPRESA" in df.columns else list(df.columns)[0]
+col_empresa = schema.col_empresa
+col_periodo = schema.col_periodo
+
+# Períodos e clientes da base ou, no DuckDB, do cubo (a base não está em memória)
+if USE_SQL:
+    periodos_base = cube.consolidated.index.to_series()
+    empresas_base = cube.by_client.index.get_level_values(1).to_series()
+else:
+    periodos_base, empresas_base = df[col_periodo], df[col_empresa]
 
 # PRIORIDADE: nova coluna "MÊS REF"; fallback para "TIMES"
-if "MÊS REF" in df.columns:
-    col_periodo = "MÊS REF"
-    periodos_unique = df[col_periodo].dropna().drop_duplicates().sort_values()
+if schema.has_mes_ref:
+    periodos_unique = periodos_base.dropna().drop_duplicates().sort_values()
     labels = [month_label(pd.to_datetime(x)) for x in periodos_unique]
     idx_default = len(labels) - 1 if len(labels) > 0 else 0
     label_sel = st.sidebar.selectbox("Período (MÊS REF – fim do mês)", labels, index=idx_default)
     periodo_sel_dt = periodos_unique.iloc[labels.index(label_sel)] if len(labels) > 0 else None
 else:
     # Fallback legacy
-    col_periodo = "TIMES" if "TIMES" in df.columns else ( [c for c in df.columns if c.lower().startswith("time")] + [list(df.columns)[-1]] )[0]
-    periodos = sorted(df[col_periodo].dropna().astype(str).unique().tolist())
+    periodos = sorted(periodos_base.dropna().astype(str).unique().tolist())
     label_sel = st.sidebar.selectbox("Período (TIMES)", periodos, index=len(periodos)-1)
     periodo_sel_dt = None  # não usado no fallback
 
-empresas = sorted(df[col_empresa].dropna().astype(str).unique().tolist())
+# Chave de período usada no cubo/índices
+periodo_key = periodo_sel_dt if schema.has_mes_ref else str(label_sel)
+
+empresas = sorted(empresas_base.dropna().astype(str).unique().tolist())
 cliente_sel = st.sidebar.selectbox("Cliente", empresas, index=0)
 
-aba = st.sidebar.radio("Visão", ["DRE por Cliente", "DRE Consolidado", "Dashboard", "Orçado x Realizado"], index=0)
+aba = st.sidebar.radio("Visão", ["DRE por Cliente", "DRE Consolidado", "Dashboard", "Orçado x Realizado",
+                                 "Orçado x Realizado – Carteira", "Contratos", "Tendência"], index=0)
 
 with st.sidebar.expander("Dicionário de Dados", expanded=False):
     st.markdown(
@@ -160,69 +207,221 @@ with st.sidebar.expander("Dicionário de Dados", expanded=False):
 # -----------------------------
 # Helpers de cálculo
 # -----------------------------
-def compute_totals(dff: pd.DataFrame):
-    fat_bruto = dff[col_fat].fillna(0).sum() if col_fat else 0
-    deducoes = dff[col_ded].fillna(0).sum() if col_ded else 0
-    fat_liq = fat_bruto - deducoes
-    csp = dff[cost_cols].fillna(0).sum().sum() if cost_cols else 0
-    mc = fat_liq - csp
-    return fat_bruto, deducoes, fat_liq, csp, mc
-
-@st.cache_data(show_spinner=False)
-def load_budget(path: str, preferred_sheet: str = "bd"):
-    xls = pd.ExcelFile(path, engine="openpyxl")
-    sheetnames = [str(s).strip() for s in xls.sheet_names]
-    target = None
-    for s in sheetnames:
-        if s.lower() == preferred_sheet.lower():
-            target = s
-            break
-    if target is None:
-        target = sheetnames[0]
-    dfb = pd.read_excel(xls, sheet_name=target, engine="openpyxl")
-    dfb.columns = [str(c).strip() for c in dfb.columns]
-    if "MÊS REF" in dfb.columns:
-        dfb["MÊS REF"] = pd.to_datetime(dfb["MÊS REF"], errors="coerce")
-        dfb["PERIODO_LABEL"] = dfb["MÊS REF"].apply(month_label)
-    return dfb, target
-
-def compute_block(df_block: pd.DataFrame, col_fat, col_ded, cost_cols):
-    fat = df_block[col_fat].fillna(0).sum() if col_fat else 0
-    ded = df_block[col_ded].fillna(0).sum() if col_ded else 0
-    fat_liq = fat - ded
-    csp = df_block[cost_cols].fillna(0).sum().sum() if cost_cols else 0
-    mc = fat_liq - csp
-    return {"FAT BRUTO": fat, "DEDUÇÕES": ded, "FAT LÍQ": fat_liq, "CSP": csp, "MC": mc}
-
-def block_dre(title: str, dff: pd.DataFrame):
-    fat_bruto, deducoes, fat_liq, csp, mc = compute_totals(dff)
+@st.cache_resource(**SHARED)
+def load_budget(path: str, sheet_prefix: str = "BD CONT", signature=None):
+    # Lê, limpa e resolve o schema do orçamento uma vez por versão do arquivo
+    timer.miss("load_budget")
+    dfb, sheet = load_cached(path, prefix=sheet_prefix, dtypes=budget_dtypes, plan_key=BUDGET_PLAN_KEY)
+    return build_budget(dfb, sheet)
+
+def require_budget():
+    # === Fonte ORÇADO: BD CONT NOVO.xlsx / aba BD CONT ===
+    budget_path = Path("BD CONT NOVO.xlsx")
+    if not budget_path.exists():
+        st.error("Arquivo de orçamento 'BD CONT NOVO.xlsx' não encontrado na raiz. Suba o arquivo e recarregue.")
+        st.stop()
+
+    # Leitura robusta da aba BD CONT (cache Parquet em .dre_cache/), schema já resolvido
+    timer.hit("load_budget")
+    with timer.stage("load"):
+        return load_budget(str(budget_path), sheet_prefix="BD CONT", signature=file_signature(budget_path))
+
+@st.cache_resource(show_spinner=False)
+def real_lines_store() -> dict:
+    # Último REALIZADO de cada base com os hashes por período (como o cube_store)
+    return {}
+
+@st.cache_resource(**SHARED)
+def load_real_lines(path: str, signature=None):
+    # REALIZADO (colunas do Orçado x Realizado) por (período, cliente), uma vez por versão da base;
+    # como no cubo, uma versão nova só recalcula os períodos com conteúdo diferente
+    if USE_SQL:
+        timer.miss("load_real_lines", backend="duckdb")
+        return load_backend(path, signature=signature).real_lines()
+    df_, _, _ = load_data(path, preferred_sheet="bd", signature=signature)
+    schema_ = resolve_schema(df_)
+    real_cols = resolve_real_cols(df_)
+    hashes = load_period_hashes(path, signature=signature)
+    previous = real_lines_store().get(path)
+    if previous is None or previous[1] != (schema_, real_cols):
+        by_client, _ = group_lines(df_, schema_, *real_cols)
+        timer.miss("load_real_lines", periodos=len(hashes))
+    else:
+        changed = changed_periods(previous[0], hashes)
+        by_client = update_real_lines(previous[2], df_, schema_, changed)
+        timer.miss("load_real_lines", periodos=len(changed))
+    real_lines_store()[path] = (hashes, (schema_, real_cols), by_client)
+    return by_client
+
+@st.cache_resource(**SHARED)
+def load_contracts(path: str, signature=None):
+    # Contratos (formato longo Cliente × Bases × Valor) com o índice por cliente, uma vez por versão do arquivo
+    timer.miss("load_contracts")
+    dfc, sheet = load_cached(path, prefix="BD CONTRATOS", usecols=contract_usecols, dtypes=contract_dtypes,
+                             plan_key=CONTRACT_PLAN_KEY)
+    return build_contracts(dfc, sheet)
+
+@st.cache_resource(**SHARED)
+def load_contract_cube(path: str, contracts_path: str, signature=None, contracts_signature=None):
+    # Realizado do cubo ligado aos contratos uma vez por versão da base e dos contratos
+    timer.miss("load_contract_cube")
+    return build_contract_cube(load_cube(path, signature=signature),
+                               load_contracts(contracts_path, signature=contracts_signature))
+
+def require_contracts():
+    contracts_path = Path("BD CONTRATOS.xlsx")
+    if not contracts_path.exists():
+        st.error("Arquivo de contratos 'BD CONTRATOS.xlsx' não encontrado na raiz. Suba o arquivo e recarregue.")
+        st.stop()
+    contracts_signature = file_signature(contracts_path)
+    timer.hit("load_contracts")
+    with timer.stage("load"):
+        contracts = load_contracts(str(contracts_path), signature=contracts_signature)
+    timer.hit("load_contract_cube")
+    with timer.stage("aggregate"):
+        contract_cube = load_contract_cube(data_spec, str(contracts_path), signature=data_signature,
+                                           contracts_signature=contracts_signature)
+    return contracts, contract_cube
+
+def statement_html(heading: str, linhas: pd.Series, cost_cols_) -> str:
+    # DRE inteira (rótulos, R$, AV%, destaques e divisórias) num único elemento HTML
+    with timer.stage("aggregate"):
+        stmt = dre_statement(linhas, cost_cols_)
+    valores = money_series(stmt["Valor"])
+    avs = perc_series(stmt["AV%"])
+    with timer.stage("format"):
+        return statement_table_html(heading, stmt, valores, avs)
+
+def block_dre(title: str, linhas: pd.Series, heading: str = "REALIZADO", cost_cols_=None):
+    # `linhas`: uma linha do cubo (FAT BRUTO, DEDUÇÕES, FAT LÍQ, custos, CSP, MC)
+    if title:
+        st.markdown(f"### {title}")
+    st.markdown(statement_html(heading, linhas, cost_cols if cost_cols_ is None else cost_cols_), unsafe_allow_html=True)
+
+@st.cache_resource(show_spinner=False, max_entries=4096)
+def cube_statement(path: str, cliente, periodo, version, _signature=None) -> str:
+    # DRE pronta (HTML) de um cliente – ou do consolidado, com cliente=None – no período; aquecida em segundo plano.
+    # Chave pelo conteúdo do período (`version`), não pela base: meses inalterados seguem em cache numa versão nova
+    timer.miss("cube_statement")
+    cube_ = load_cube(path, signature=_signature)
+    linhas = cube_.total(periodo) if cliente is None else cube_.get(cliente, periodo)
+    return statement_html("REALIZADO", linhas, cube_.schema.cost_cols)
+
+def show_statement(title: str, cliente, periodo):
     if title:
         st.markdown(f"### {title}")
-    def linha(label, valor, base_pct, highlight=False):
-        c1, c2, c3 = st.columns([2.8, 1.2, 0.8])
-        with c1:
-            st.markdown(f"**{label}**" if highlight else label)
-        with c2:
-            st.markdown(f"<div style='text-align:right'>{money(valor)}</div>", unsafe_allow_html=True)
-        with c3:
-            st.markdown(f"<div style='text-align:right'>{perc(pct(valor, base_pct))}</div>", unsafe_allow_html=True)
+    timer.hit("cube_statement")
+    st.markdown(cube_statement(data_spec, cliente, periodo, period_version(periodo), _signature=data_signature),
+                unsafe_allow_html=True)
+
+@st.cache_resource(show_spinner=False, max_entries=256)
+def period_ranking(path: str, periodo, version, _signature=None) -> pd.DataFrame:
+    # Linhas do cubo do período (uma por EMPRESA), com os nomes usados nos rankings do Dashboard (chave como em cube_statement)
+    timer.miss("period_ranking")
+    return load_cube(path, signature=_signature).period_slice(periodo).rename(columns={
+        "FAT BRUTO": "FATURAMENTO_BRUTO",
+        "FAT LÍQ": "FATURAMENTO_LIQ",
+        "MC": "MARGEM_CONTRIB",
+        "MC%": "MC_PCT_BRUTO",
+    })
+
+QA_PAGE_SIZES = [25, 50, 100, 250]
+
+def qa_grid(data: pd.DataFrame, positions, key: str):
+    # Base de QA paginada no servidor: filtro/ordenação sobre as posições do índice e
+    # só a página visível (nas colunas escolhidas) é montada e enviada ao navegador
+    cols = list(data.columns)
+    c1, c2, c3 = st.columns([3, 2, 1])
+    with c1:
+        shown = st.multiselect("Colunas", cols, default=cols, key=f"{key}_cols")
+    with c2:
+        sort_by = st.selectbox("Ordenar por", [None] + cols, format_func=lambda c: "(ordem da planilha)" if c is None else c,
+                               key=f"{key}_sort")
+    with c3:
+        desc = st.toggle("Decrescente", key=f"{key}_desc")
+    c1, c2, c3, c4 = st.columns([2, 3, 1, 1])
+    with c1:
+        filter_col = st.selectbox("Filtrar coluna", cols, key=f"{key}_fcol")
+    with c2:
+        filter_text = st.text_input("contém", key=f"{key}_ftext")
+    with c3:
+        page_size = st.selectbox("Linhas/página", QA_PAGE_SIZES, index=1, key=f"{key}_size")
+    with timer.stage("filter"):
+        pos = qa_positions(data, positions, sort_by, not desc, filter_col, filter_text.strip())
+    pages = max(-(-len(pos) // page_size), 1)
+    with c4:
+        page = st.number_input("Página", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page")
+    with timer.stage("filter"):
+        rows = qa_page(data, pos, min(int(page), pages) - 1, page_size, shown)
+    st.dataframe(rows, width="stretch")
+    st.caption(f"{len(pos)} de {len(positions)} linhas | página {min(int(page), pages)} de {pages}")
+
+def qa_base(cliente, key: str):
+    # Linhas brutas do período (e cliente): posições do índice na base em memória ou consulta ao Parquet (DuckDB)
+    if USE_SQL:
+        with timer.stage("filter"):
+            rows = backend.rows(periodo_key, cliente)
+        qa_grid(rows, range(len(rows)), key=key)
+    else:
+        timer.hit("load_row_index")
+        with timer.stage("filter"):
+            row_index = load_row_index(data_spec, signature=data_signature)
+            positions = (row_index.period_positions(periodo_key) if cliente is None
+                         else row_index.client_period_positions(cliente, periodo_key))
+        qa_grid(df, positions, key=key)
+
+def qa_expander(label: str, key: str):
+    # Conteúdo só é calculado com o expander aberto (on_change="rerun" devolve o estado em .open)
+    box = st.expander(label, key=key, on_change="rerun")
+    return box if box.open else None
 
-    st.divider()
-    st.markdown("#### REALIZADO | AV%")
-    linha("(+) FATURAMENTO BRUTO", fat_bruto, fat_bruto, highlight=True)
-    linha("(–) DEDUÇÕES LEGAIS", deducoes, fat_bruto)
-    linha("(=) FATURAMENTO LÍQUIDO", fat_liq, fat_bruto, highlight=True)
-    st.divider()
-    linha("(–) CSP", csp, fat_bruto, highlight=True)
-    if cost_cols:
-        for cname in cost_cols:
-            linha(f"(–) {cname}", dff[cname].fillna(0).sum(), fat_bruto)
-    st.divider()
-    linha("(=) MARGEM DE CONTRIBUIÇÃO", mc, fat_bruto, highlight=True)
+# -----------------------------
+# Pré-cálculo em segundo plano (dre_warm)
+# -----------------------------
+# Maior Top-N dos rankings do Dashboard
+DASHBOARD_TOP_MAX = 20
+# Só o que o Dashboard mostra é aquecido: o topo do ranking de faturamento e o cliente que o drill-down abre.
+# São até WARM_TOP + 2 DREs por período, então o aquecimento não expulsa entradas do próprio cube_statement.
+WARM_TOP = DASHBOARD_TOP_MAX
+
+@st.cache_resource(show_spinner=False)
+def prefetcher() -> Prefetcher:
+    # Um pool por processo, compartilhado pelas sessões; DRE_WARM_WORKERS=0 desliga.
+    # Lembra as chaves das mesmas versões da base que os caches SHARED guardam
+    return Prefetcher(int(os.environ.get("DRE_WARM_WORKERS", "2")), generations=SHARED["max_entries"])
+
+def warm_top_clients(path: str, periodo, version, signature, top: int):
+    ranking = period_ranking(path, periodo, version, _signature=signature)
+    clientes = ranking.nlargest(top, "FATURAMENTO_BRUTO").index.tolist() + ranking.index[:1].tolist()
+    for cliente in dict.fromkeys(clientes):
+        cube_statement(path, cliente, periodo, version, _signature=signature)
+
+def warm_statement(cliente, periodo):
+    warm.submit((data_signature, "dre", cliente, periodo), cube_statement, data_spec, cliente, periodo,
+                period_version(periodo), _signature=data_signature)
+
+def warm_period(periodo):
+    # Consolidado, ranking do Dashboard e DRE dos clientes que ele mostra
+    warm_statement(None, periodo)
+    warm.submit((data_signature, "ranking", periodo), warm_top_clients, data_spec, periodo, period_version(periodo),
+                data_signature, WARM_TOP)
+
+warm = prefetcher()
+periodos_cubo = cube.consolidated.index.tolist()
+if periodos_cubo:
+    # Depois da seleção: meses vizinhos do cliente e do consolidado, e o topo do período escolhido
+    warm_period(periodo_key)
+    for p in neighbours(periodos_cubo, periodo_key):
+        warm_statement(cliente_sel, p)
+        warm_period(p)
+    # Início: último período completo (uma vez por versão da base; chaves repetidas são ignoradas)
+    warm_period(periodos_cubo[-1])
 
 # -----------------------------
 # Layout – Cabeçalho
 # -----------------------------
+# Daqui em diante o que não for filtro/agregação/formatação conta como render
+timer.begin("render")
 st.title("Elicon – DRE (Streamlit)")
 st.caption("Leitura da base 'BD.xlsx' com aba autodetectada e período por 'MÊS REF' (fim do mês).")
 
@@ -230,27 +429,15 @@ st.caption("Leitura da base 'BD.xlsx' com aba autodetectada e período por 'MÊS
 # Abas
 # -----------------------------
 if aba in ["DRE por Cliente", "DRE Consolidado"]:
-    # Filtragem base
-    if aba == "DRE por Cliente":
-        if "MÊS REF" in df.columns:
-            dff = df[(df[col_empresa].astype(str) == str(cliente_sel)) & (df["MÊS REF"] == periodo_sel_dt)].copy()
-            titulo = f"DRE – {cliente_sel} | {label_sel}"
-        else:
-            dff = df[(df[col_empresa].astype(str) == str(cliente_sel)) & (df[col_periodo].astype(str) == str(label_sel))].copy()
-            titulo = f"DRE – {cliente_sel} | {label_sel}"
-    else:
-        if "MÊS REF" in df.columns:
-            dff = df[df["MÊS REF"] == periodo_sel_dt].copy()
-            titulo = f"DRE – Consolidado | {label_sel}"
-        else:
-            dff = df[(df[col_periodo].astype(str) == str(label_sel))].copy()
-            titulo = f"DRE – Consolidado | {label_sel}"
+    # DRE do cubo; as linhas brutas só são lidas na base de QA
+    cliente_dre = cliente_sel if aba == "DRE por Cliente" else None
+    st.subheader(f"DRE – {cliente_sel} | {label_sel}" if cliente_dre is not None else f"DRE – Consolidado | {label_sel}")
+    show_statement("", cliente_dre, periodo_key)
 
-    st.subheader(titulo)
-    block_dre("", dff)
-
-    with st.expander("Ver base filtrada (controle/QA)"):
-        st.dataframe(dff, use_container_width=True)
+    qa = qa_expander("Ver base filtrada (controle/QA)", key="qa_base")
+    if qa is not None:
+        with qa:
+            qa_base(cliente_dre, key="qa_base")
 
     st.caption("Origem dos dados: colunas sinalizadas no template. Percentuais = valor ÷ FATURAMENTO BRUTO.")
 
@@ -265,51 +452,31 @@ elif aba == "Dashboard":
     with c1:
         mc_mode = st.radio("Modo de Margem de Contribuição nos Rankings", ["Percentual (%)", "Valor (R$)"], index=0, horizontal=True)
     with c2:
-        top_n = st.slider("Top-N", min_value=5, max_value=20, value=10, step=1)
+        top_n = st.slider("Top-N", min_value=5, max_value=DASHBOARD_TOP_MAX, value=10, step=1)
 
-    # Filtra dataframe para o mês corrente selecionado
-    if "MÊS REF" in df.columns:
-        dfm = df[df["MÊS REF"] == periodo_sel_dt].copy()
-    else:
-        dfm = df[df[col_periodo].astype(str) == str(label_sel)].copy()
-
-    # Agrupa por EMPRESA (período atual)
-    agg_dict = {}
-    if col_fat: agg_dict[col_fat] = "sum"
-    if col_ded: agg_dict[col_ded] = "sum"
-    for c in cost_cols:
-        agg_dict[c] = "sum"
-
-    if not agg_dict:
+    if not schema.value_cols:
         st.warning("Não foi possível identificar as colunas necessárias para o dashboard.")
     else:
-        by_emp = dfm.groupby(col_empresa, dropna=True).agg(agg_dict).fillna(0)
-        # Derivados
-        by_emp["FATURAMENTO_BRUTO"] = by_emp[col_fat] if col_fat in by_emp.columns else 0
-        by_emp["FATURAMENTO_LIQ"] = (by_emp[col_fat] if col_fat in by_emp.columns else 0) - (by_emp[col_ded] if col_ded in by_emp.columns else 0)
-        by_emp["CSP"] = by_emp[cost_cols].sum(axis=1) if cost_cols else 0
-        by_emp["MARGEM_CONTRIB"] = by_emp["FATURAMENTO_LIQ"] - by_emp["CSP"]
-        # Percentual de margem de contribuição sobre Faturamento Bruto
-        by_emp["MC_PCT_BRUTO"] = 0.0
-        if col_fat and col_fat in by_emp.columns:
-            denom = by_emp["FATURAMENTO_BRUTO"].replace(0, pd.NA)
-            by_emp["MC_PCT_BRUTO"] = (by_emp["MARGEM_CONTRIB"] / denom).fillna(0.0)
+        # Linhas do cubo para o período atual (uma por EMPRESA), compartilhadas e somente-leitura
+        timer.hit("period_ranking")
+        with timer.stage("aggregate"):
+            by_emp = period_ranking(data_spec, periodo_key, period_version(periodo_key), _signature=data_signature)
 
         # Top Faturamento (bruto)
         if col_fat:
-            top_fat = by_emp.sort_values(col_fat, ascending=False).head(top_n)
+            top_fat = by_emp.sort_values("FATURAMENTO_BRUTO", ascending=False).head(top_n)
             st.markdown(f"### Top {top_n} – Faturamento Bruto (mês selecionado)")
-            st.bar_chart(top_fat[col_fat])
-            df_show = top_fat[[col_fat]].rename(columns={col_fat: "FATURAMENTO BRUTO"}).copy()
-            df_show["FATURAMENTO BRUTO"] = df_show["FATURAMENTO BRUTO"].map(money)
+            st.bar_chart(top_fat["FATURAMENTO_BRUTO"].rename(col_fat))
+            df_show = top_fat[["FATURAMENTO_BRUTO"]].rename(columns={"FATURAMENTO_BRUTO": "FATURAMENTO BRUTO"})
+            df_show["FATURAMENTO BRUTO"] = money_series(df_show["FATURAMENTO BRUTO"])
             st.dataframe(df_show)
 
         # Top CSP
         st.markdown(f"### Top {top_n} – CSP (mês selecionado)")
         top_csp = by_emp.sort_values("CSP", ascending=False).head(top_n)
         st.bar_chart(top_csp["CSP"])
-        df_show = top_csp[["CSP"]].copy()
-        df_show["CSP"] = df_show["CSP"].map(money)
+        df_show = top_csp[["CSP"]]
+        df_show["CSP"] = money_series(df_show["CSP"])
         st.dataframe(df_show)
 
         # Top/Bottom Margens – modo dinâmico
@@ -317,35 +484,35 @@ elif aba == "Dashboard":
             st.markdown(f"### Top {top_n} – Melhores Margens de Contribuição (%) (mês selecionado)")
             top_mc_best = by_emp.sort_values("MC_PCT_BRUTO", ascending=False).head(top_n)
             st.bar_chart(top_mc_best["MC_PCT_BRUTO"])
-            df_best = top_mc_best[["MC_PCT_BRUTO", "MARGEM_CONTRIB", "FATURAMENTO_BRUTO"]].rename(columns={"MC_PCT_BRUTO":"MC % (sobre FAT BRUTO)"}).copy()
-            df_best["MC % (sobre FAT BRUTO)"] = df_best["MC % (sobre FAT BRUTO)"].map(perc)
-            df_best["MARGEM_CONTRIB"] = df_best["MARGEM_CONTRIB"].map(money)
-            df_best["FATURAMENTO_BRUTO"] = df_best["FATURAMENTO_BRUTO"].map(money)
+            df_best = top_mc_best[["MC_PCT_BRUTO", "MARGEM_CONTRIB", "FATURAMENTO_BRUTO"]].rename(columns={"MC_PCT_BRUTO":"MC % (sobre FAT BRUTO)"})
+            df_best["MC % (sobre FAT BRUTO)"] = perc_series(df_best["MC % (sobre FAT BRUTO)"])
+            df_best["MARGEM_CONTRIB"] = money_series(df_best["MARGEM_CONTRIB"])
+            df_best["FATURAMENTO_BRUTO"] = money_series(df_best["FATURAMENTO_BRUTO"])
             st.dataframe(df_best)
 
             st.markdown(f"### Top {top_n} – Piores Margens de Contribuição (%) (mês selecionado)")
             top_mc_worst = by_emp.sort_values("MC_PCT_BRUTO", ascending=True).head(top_n)
             st.bar_chart(top_mc_worst["MC_PCT_BRUTO"])
-            df_worst = top_mc_worst[["MC_PCT_BRUTO", "MARGEM_CONTRIB", "FATURAMENTO_BRUTO"]].rename(columns={"MC_PCT_BRUTO":"MC % (sobre FAT BRUTO)"}).copy()
-            df_worst["MC % (sobre FAT BRUTO)"] = df_worst["MC % (sobre FAT BRUTO)"].map(perc)
-            df_worst["MARGEM_CONTRIB"] = df_worst["MARGEM_CONTRIB"].map(money)
-            df_worst["FATURAMENTO_BRUTO"] = df_worst["FATURAMENTO_BRUTO"].map(money)
+            df_worst = top_mc_worst[["MC_PCT_BRUTO", "MARGEM_CONTRIB", "FATURAMENTO_BRUTO"]].rename(columns={"MC_PCT_BRUTO":"MC % (sobre FAT BRUTO)"})
+            df_worst["MC % (sobre FAT BRUTO)"] = perc_series(df_worst["MC % (sobre FAT BRUTO)"])
+            df_worst["MARGEM_CONTRIB"] = money_series(df_worst["MARGEM_CONTRIB"])
+            df_worst["FATURAMENTO_BRUTO"] = money_series(df_worst["FATURAMENTO_BRUTO"])
             st.dataframe(df_worst)
         else:
             st.markdown(f"### Top {top_n} – Maiores Margens de Contribuição (R$) (mês selecionado)")
             top_mc_best = by_emp.sort_values("MARGEM_CONTRIB", ascending=False).head(top_n)
             st.bar_chart(top_mc_best["MARGEM_CONTRIB"])
-            df_best = top_mc_best[["MARGEM_CONTRIB", "FATURAMENTO_BRUTO"]].copy()
-            df_best["MARGEM_CONTRIB"] = df_best["MARGEM_CONTRIB"].map(money)
-            df_best["FATURAMENTO_BRUTO"] = df_best["FATURAMENTO_BRUTO"].map(money)
+            df_best = top_mc_best[["MARGEM_CONTRIB", "FATURAMENTO_BRUTO"]]
+            df_best["MARGEM_CONTRIB"] = money_series(df_best["MARGEM_CONTRIB"])
+            df_best["FATURAMENTO_BRUTO"] = money_series(df_best["FATURAMENTO_BRUTO"])
             st.dataframe(df_best)
 
             st.markdown(f"### Top {top_n} – Menores Margens de Contribuição (R$) (mês selecionado)")
             top_mc_worst = by_emp.sort_values("MARGEM_CONTRIB", ascending=True).head(top_n)
             st.bar_chart(top_mc_worst["MARGEM_CONTRIB"])
-            df_worst = top_mc_worst[["MARGEM_CONTRIB", "FATURAMENTO_BRUTO"]].copy()
-            df_worst["MARGEM_CONTRIB"] = df_worst["MARGEM_CONTRIB"].map(money)
-            df_worst["FATURAMENTO_BRUTO"] = df_worst["FATURAMENTO_BRUTO"].map(money)
+            df_worst = top_mc_worst[["MARGEM_CONTRIB", "FATURAMENTO_BRUTO"]]
+            df_worst["MARGEM_CONTRIB"] = money_series(df_worst["MARGEM_CONTRIB"])
+            df_worst["FATURAMENTO_BRUTO"] = money_series(df_worst["FATURAMENTO_BRUTO"])
             st.dataframe(df_worst)
 
         st.divider()
@@ -354,11 +521,7 @@ elif aba == "Dashboard":
         clientes_rank = by_emp.index.tolist()
         if clientes_rank:
             cliente_pick = st.selectbox("Selecione um cliente para ver a DRE do período", clientes_rank, index=0)
-            if "MÊS REF" in df.columns:
-                dff_drill = df[(df[col_empresa].astype(str) == str(cliente_pick)) & (df["MÊS REF"] == periodo_sel_dt)].copy()
-            else:
-                dff_drill = df[(df[col_empresa].astype(str) == str(cliente_pick)) & (df[col_periodo].astype(str) == str(label_sel))].copy()
-            block_dre(f"DRE – {cliente_pick} | {label_sel}", dff_drill)
+            show_statement(f"DRE – {cliente_pick} | {label_sel}", cliente_pick, periodo_key)
         else:
             st.info("Nenhum cliente encontrado no período selecionado.")
 
@@ -366,146 +529,238 @@ elif aba == "Dashboard":
 elif aba == "Orçado x Realizado":
     st.subheader(f"Orçado x Realizado – {cliente_sel} | {label_sel if 'label_sel' in locals() else ''}")
 
-    # === Fonte ORÇADO: BD CONT NOVO.xlsx / aba BD CONT ===
-    budget_path = Path("BD CONT NOVO.xlsx")
-    if not budget_path.exists():
-        st.error("Arquivo de orçamento 'BD CONT NOVO.xlsx' não encontrado na raiz. Suba o arquivo e recarregue.")
-        st.stop()
-
-    # Leitura robusta da aba BD CONT
-    import openpyxl
-    xls_b = pd.ExcelFile(str(budget_path), engine="openpyxl")
-    sheet_bud = None
-    for s in xls_b.sheet_names:
-        if str(s).strip().upper().startswith("BD CONT"):
-            sheet_bud = s
-            break
-    if sheet_bud is None:
-        sheet_bud = xls_b.sheet_names[0]
-    dfb = pd.read_excel(xls_b, sheet_name=sheet_bud, engine="openpyxl")
-    dfb.columns = [str(c).strip() for c in dfb.columns]
-
-    # Mapas de colunas – ORÇADO (conforme títulos fornecidos)
-    bud_cliente = "Cliente" if "Cliente" in dfb.columns else resolve_col_ci(dfb, ["cliente","empresa","contrato"])
-    bud_ded = "(-) DEDUÇÕES LEGAIS" if "(-) DEDUÇÕES LEGAIS" in dfb.columns else resolve_col_ci(dfb, ["(-) deduções legais","deduções legais","deducoes legais"])
-    bud_sal = "(-) SALÁRIO" if "(-) SALÁRIO" in dfb.columns else resolve_col_ci(dfb, ["(-) salário","salário","salario"])
-    bud_vt  = "(-) VALE TRANSPORTE " if "(-) VALE TRANSPORTE " in dfb.columns else resolve_col_ci(dfb, ["(-) vale transporte","vale transporte"])
-    bud_va  = "(-) VALE ALIMENTAÇÃO" if "(-) VALE ALIMENTAÇÃO" in dfb.columns else resolve_col_ci(dfb, ["(-) vale alimentação","vale alimentacao","vale alimentação"])
-    bud_vr  = "(-) VALE REFEIÇÃO" if "(-) VALE REFEIÇÃO" in dfb.columns else resolve_col_ci(dfb, ["(-) vale refeição","vale refeicao","vale refeição"])
-    bud_ass = "(-) ASSIDUIDADE" if "(-) ASSIDUIDADE" in dfb.columns else resolve_col_ci(dfb, ["(-) assiduidade","assiduidade"])
-    bud_fat = "(+) FATURAMENTO BRUTO" if "(+) FATURAMENTO BRUTO" in dfb.columns else resolve_col_ci(dfb, ["(+) faturamento bruto","faturamento bruto"])
-    bud_mco = "(-) MATERIAL DE CONSUMO" if "(-) MATERIAL DE CONSUMO" in dfb.columns else resolve_col_ci(dfb, ["(-) material de consumo","material de consumo"])
-    bud_enc = "(-) TOTAL ENCARGOS" if "(-) TOTAL ENCARGOS" in dfb.columns else resolve_col_ci(dfb, ["(-) total encargos","total encargos","encargos"])
-
-    bud_cost_cols = [c for c in [bud_sal, bud_vt, bud_va, bud_vr, bud_ass, bud_mco, bud_enc] if c]
-
-    # Filtragem: realizado (BD.xlsx) por cliente + período; orçado (BD CONT NOVO.xlsx) só por cliente
-    if "MÊS REF" in df.columns:
-        dff_real = df[(df[col_empresa].astype(str) == str(cliente_sel)) & (df["MÊS REF"] == periodo_sel_dt)].copy()
-    else:
-        dff_real = df[(df[col_empresa].astype(str) == str(cliente_sel)) & (df[col_periodo].astype(str) == str(label_sel))].copy()
+    budget = require_budget()
+    bud_fat, bud_ded, bud_cost_cols = budget.col_fat, budget.col_ded, budget.cost_cols
 
-    dff_bud = dfb[dfb[bud_cliente].astype(str) == str(cliente_sel)].copy()
+    # Filtragem: orçado (BD CONT NOVO.xlsx) só por cliente
+    with timer.stage("filter"):
+        dff_bud = budget.client_rows(cliente_sel)
 
     # Resolver colunas REALIZADO no BD.xlsx (podem ter nomes levemente distintos)
-    real_ded = resolve_col(df, ["DEDUÇÕES LEGAIS","(-) DEDUÇÕES LEGAIS"])
-    real_sal = resolve_col(df, ["SALÁRIO","(-) SALÁRIO"])
-    real_vt  = resolve_col(df, ["VALE TRANSPORTE ","(-) VALE TRANSPORTE "])
-    real_va  = resolve_col(df, ["VALE ALIMENTAÇÃO","(-) VALE ALIMENTAÇÃO"])
-    real_vr  = resolve_col(df, ["VALE REFEIÇÃO","(-) VALE REFEIÇÃO"])
-    real_ass = resolve_col(df, ["ASSIDUIDADE","(-) ASSIDUIDADE"])
-    real_fat = resolve_col(df, ["FAT MÊS $","(+) FATURAMENTO BRUTO"])
-    real_mco = resolve_col(df, ["MATERIAL DE CONSUMO","(-) MATERIAL DE CONSUMO"])
-    real_enc = resolve_col(df, ["TOTAL ENCARGOS","(-) TOTAL ENCARGOS"])
-    real_cost_cols = [c for c in [real_sal, real_vt, real_va, real_vr, real_ass, real_mco, real_enc] if c]
-
-    def sum_col(df_in, col):
-        return df_in[col].fillna(0).sum() if col and col in df_in.columns else 0.0
-
-    # Orçado (R$)
-    orc_fat = sum_col(dff_bud, bud_fat)
-    orc_ded = sum_col(dff_bud, bud_ded)
-    orc_fat_liq = orc_fat - orc_ded
-    orc_csp = sum([sum_col(dff_bud, c) for c in bud_cost_cols])
-    orc_mc = orc_fat_liq - orc_csp
-
-    # Realizado (R$)
-    real_fat_v = sum_col(dff_real, real_fat)
-    real_ded_v = sum_col(dff_real, real_ded)
-    real_fat_liq = real_fat_v - real_ded_v
-    real_csp = sum([sum_col(dff_real, c) for c in real_cost_cols])
-    real_mc = real_fat_liq - real_csp
-
-    import numpy as np
-    def safe_div(a, b):
-        return (a / b) if b not in (0, None) else 0.0
-
-    rows = ["FAT BRUTO","DEDUÇÕES","FAT LÍQ","CSP","MC"]
-    comp = pd.DataFrame({
-        "Linha": rows,
-        "Orçado (R$)": [orc_fat, orc_ded, orc_fat_liq, orc_csp, orc_mc],
-        "Realizado (R$)": [real_fat_v, real_ded_v, real_fat_liq, real_csp, real_mc],
-    }).set_index("Linha")
-    comp["Δ (R$)"] = comp["Realizado (R$)"] - comp["Orçado (R$)"]
-    comp["Δ (%)"] = comp["Δ (R$)"] / comp["Orçado (R$)"].replace({0: pd.NA})
-
-    comp_show = comp.copy()
-    comp_show["Orçado (R$)"] = comp_show["Orçado (R$)"].map(money)
-    comp_show["Realizado (R$)"] = comp_show["Realizado (R$)"].map(money)
-    comp_show["Δ (R$)"] = comp_show["Δ (R$)"].map(money)
-    comp_show["Δ (%)"] = comp_show["Δ (%)"].map(perc)
+    with timer.stage("schema"):
+        _, _, real_cost_cols = resolve_real_cols(pd.DataFrame(columns=backend.header) if USE_SQL else df)
+
+    # Orçado (linhas já somadas por cliente) x Realizado (REALIZADO agregado por período e cliente)
+    timer.hit("load_real_lines")
+    with timer.stage("aggregate"):
+        real_by_client = load_real_lines(data_spec, signature=data_signature)
+        key_real = (periodo_key, str(cliente_sel))
+        linhas_real = (real_by_client.loc[key_real] if key_real in real_by_client.index
+                       else pd.Series(0.0, index=real_by_client.columns))
+        linhas_bud = block_lines(dff_bud, bud_fat, bud_ded, bud_cost_cols)
+        comp = budget_comparison(
+            budget.lines().loc[str(cliente_sel)] if str(cliente_sel) in budget.totals.index else pd.Series(dtype=float),
+            linhas_real,
+        )
+
+    # Com Copy-on-Write, escrever em comp_show não altera comp (usado no gráfico abaixo)
+    comp_show = comp[:]
+    comp_show["Orçado (R$)"] = money_series(comp_show["Orçado (R$)"])
+    comp_show["Realizado (R$)"] = money_series(comp_show["Realizado (R$)"])
+    comp_show["Δ (R$)"] = money_series(comp_show["Δ (R$)"])
+    comp_show["Δ (%)"] = perc_series(comp_show["Δ (%)"])
 
     c1, c2 = st.columns([1,1])
     with c1:
         st.markdown("### Orçado x Realizado – Tabela Comparativa")
-        st.dataframe(comp_show, use_container_width=True)
+        st.dataframe(comp_show, width="stretch")
     with c2:
         st.markdown("### Visual Comparativo por Linha (R$)")
         st.bar_chart(comp[["Orçado (R$)","Realizado (R$)"]])
 
     st.divider()
-    with st.expander("Bases filtradas (QA)"):
-        st.markdown("**Realizado (DF base – BD.xlsx)**")
-        st.dataframe(dff_real, use_container_width=True)
-        st.markdown("**Orçado (DF orçamento – BD CONT NOVO.xlsx)**")
-        st.dataframe(dff_bud, use_container_width=True)
+    qa = qa_expander("Bases filtradas (QA)", key="qa_orc")
+    if qa is not None:
+        with qa:
+            st.markdown("**Realizado (DF base – BD.xlsx)**")
+            qa_base(cliente_sel, key="qa_orc_real")
+            st.markdown("**Orçado (DF orçamento – BD CONT NOVO.xlsx)**")
+            qa_grid(budget.df, budget.client_positions(cliente_sel), key="qa_orc_bud")
 
 
     # === Visual espelhando 'DRE por Cliente' ===
     st.divider()
     st.markdown("### Visão em blocos (mesmo visual do DRE por Cliente)")
 
-    def render_block_like_client(title, df_block, col_fat_, col_ded_, cost_cols_):
-        fat = df_block[col_fat_].fillna(0).sum() if col_fat_ in df_block.columns else 0.0
-        ded = df_block[col_ded_].fillna(0).sum() if col_ded_ in df_block.columns else 0.0
-        fat_liq = fat - ded
-        csp = df_block[cost_cols_].fillna(0).sum().sum() if cost_cols_ else 0.0
-        mc = fat_liq - csp
-
-        def linha(label, valor, base_pct, highlight=False):
-            c1, c2, c3 = st.columns([2.8, 1.2, 0.8])
-            with c1: st.markdown(f"**{label}**" if highlight else label)
-            with c2: st.markdown(f"<div style='text-align:right'>{money(valor)}</div>", unsafe_allow_html=True)
-            with c3: st.markdown(f"<div style='text-align:right'>{perc(pct(valor, base_pct))}</div>", unsafe_allow_html=True)
-
-        st.divider()
-        st.markdown(f"#### {title} | AV%")
-        linha("(+) FATURAMENTO BRUTO", fat, fat, highlight=True)
-        linha("(–) DEDUÇÕES LEGAIS", ded, fat)
-        linha("(=) FATURAMENTO LÍQUIDO", fat_liq, fat, highlight=True)
-        st.divider()
-        linha("(–) CSP", csp, fat, highlight=True)
-        if cost_cols_:
-            for cname in cost_cols_:
-                linha(f"(–) {cname}", df_block[cname].fillna(0).sum() if cname in df_block.columns else 0.0, fat)
-        st.divider()
-        linha("(=) MARGEM DE CONTRIBUIÇÃO", mc, fat, highlight=True)
-
     cA, cB = st.columns(2)
     with cA:
         st.markdown(f"### Realizado – {cliente_sel} | {label_sel if 'label_sel' in locals() else ''}")
-        render_block_like_client("REALIZADO", dff_real, real_fat, real_ded, real_cost_cols)
+        block_dre("", linhas_real, "REALIZADO", real_cost_cols)
     with cB:
         st.markdown(f"### Orçado – {cliente_sel}")
-        render_block_like_client("ORÇADO", dff_bud, bud_fat, bud_ded, bud_cost_cols)
-    
\ No newline at end of file
+        block_dre("", linhas_bud, "ORÇADO", bud_cost_cols)
+    
+
+elif aba == "Orçado x Realizado – Carteira":
+    # -----------------------------
+    # ORÇADO x REALIZADO – todos os clientes numa única junção
+    # -----------------------------
+    st.subheader(f"Orçado x Realizado – Carteira | {label_sel}")
+    budget = require_budget()
+
+    c1, c2, c3 = st.columns([1, 1, 1])
+    with c1:
+        linha_sel = st.selectbox("Linha da DRE", VARIANCE_LINES, index=VARIANCE_LINES.index("MC"))
+    with c2:
+        metrica = st.radio("Desvio em", ["R$", "%"], index=0, horizontal=True)
+    with c3:
+        top_n = st.slider("Top-N", min_value=5, max_value=50, value=15, step=5)
+    metric = "Δ (R$)" if metrica == "R$" else "Δ (%)"
+
+    timer.hit("load_real_lines")
+    with timer.stage("aggregate"):
+        real_by_client = load_real_lines(data_spec, signature=data_signature)
+        try:
+            real = real_by_client.xs(periodo_key, level=0)
+        except KeyError:
+            real = real_by_client.iloc[0:0].droplevel(0)
+        variance = budget_variance(budget.lines(), real)
+        sums = variance.groupby(level="Linha").sum()
+        total = budget_comparison(sums["Orçado (R$)"], sums["Realizado (R$)"])
+        ranking = rank_deviations(variance, linha_sel, metric).head(top_n)
+        matrix = variance_matrix(variance, metric)
+
+    def variance_show(frame: pd.DataFrame) -> pd.DataFrame:
+        out = pd.DataFrame(index=frame.index)
+        for c in ["Orçado (R$)", "Realizado (R$)", "Δ (R$)"]:
+            out[c] = money_series(frame[c]).to_numpy()
+        out["Δ (%)"] = perc_series(frame["Δ (%)"]).where(frame["Δ (%)"].notna(), "—").to_numpy()
+        return out
+
+    st.markdown("### Total da carteira")
+    st.dataframe(variance_show(total), width="stretch")
+
+    st.markdown(f"### Top {top_n} – Piores desvios em {linha_sel} ({metrica})")
+    st.caption("Pior = receita/margem abaixo do orçado ou custo/dedução acima do orçado.")
+    st.bar_chart(ranking[metric])
+    st.dataframe(variance_show(ranking), width="stretch")
+
+    with st.expander(f"Matriz de desvios – {len(matrix)} clientes × linhas da DRE ({metrica})"):
+        fmt = money_series if metric == "Δ (R$)" else perc_series
+        matrix_show = pd.DataFrame(index=matrix.index)
+        for c in matrix.columns:
+            matrix_show[c] = fmt(matrix[c]).where(matrix[c].notna(), "—").to_numpy()
+        st.dataframe(matrix_show, width="stretch")
+
+elif aba == "Contratos":
+    # -----------------------------
+    # CONTRATOS (BD CONTRATOS.xlsx) – junção e agregação pré-calculadas por versão da base
+    # -----------------------------
+    st.subheader(f"Contratos – {label_sel}")
+    contracts, contract_cube = require_contracts()
+
+    c1, c2, c3 = st.columns([1, 1, 1])
+    with c1:
+        grupo = st.selectbox("Agrupar por", [CONTRACT_GROUP] + CONTRACT_ATTRS, index=0)
+    with c2:
+        metrica = st.radio("Ranking por", ["FAT BRUTO", "MC", "MC%"], index=1, horizontal=True)
+    with c3:
+        top_n = st.slider("Top-N", min_value=5, max_value=30, value=10, step=1)
+
+    with timer.stage("aggregate"):
+        fatia = contract_cube.period_slice(grupo, periodo_key).sort_values(metrica, ascending=False, kind="stable")
+        ranking = fatia.head(top_n)
+
+    st.markdown(f"### Top {top_n} – {metrica} por {grupo.lower()} (mês selecionado)")
+    st.bar_chart(ranking[metrica])
+    ranking_show = pd.DataFrame(index=ranking.index)
+    for c in ["FAT BRUTO", "CSP", "MC"]:
+        ranking_show[c] = money_series(ranking[c]).to_numpy()
+    ranking_show["MC%"] = perc_series(ranking["MC%"]).to_numpy()
+    st.dataframe(ranking_show, width="stretch")
+
+    st.divider()
+    if fatia.empty:
+        st.info("Nenhum contrato com movimento no período selecionado.")
+    else:
+        # Opções na ordem do ranking: o primeiro do Top-N já vem selecionado
+        escolha = st.selectbox(f"{grupo} para ver a DRE do período", fatia.index.tolist(), index=0)
+        with timer.stage("aggregate"):
+            linhas_grupo = contract_cube.get(grupo, escolha, periodo_key)
+        if grupo == CONTRACT_GROUP and escolha in contracts.totals.index:
+            with timer.stage("aggregate"):
+                comp = budget_comparison(contracts.lines().loc[escolha], linhas_grupo)
+            comp_show = comp.rename(columns={"Orçado (R$)": "Contratado (R$)"})
+            for c in ["Contratado (R$)", "Realizado (R$)", "Δ (R$)"]:
+                comp_show[c] = money_series(comp_show[c])
+            comp_show["Δ (%)"] = perc_series(comp_show["Δ (%)"])
+            cA, cB = st.columns(2)
+            with cA:
+                block_dre(f"Realizado – {escolha} | {label_sel}", linhas_grupo)
+            with cB:
+                st.markdown("### Contratado x Realizado")
+                st.dataframe(comp_show, width="stretch")
+        else:
+            block_dre(f"DRE – {escolha} | {label_sel}", linhas_grupo)
+        if grupo in CONTRACT_ATTRS:
+            membros = contracts.attrs.index[contracts.attrs[grupo] == escolha].tolist()
+            with st.expander(f"Contratos em '{escolha}' ({len(membros)})"):
+                st.write(", ".join(membros) if membros else "Clientes sem contrato em BD CONTRATOS.xlsx.")
+
+    st.caption("Contrato = Cliente de BD CONTRATOS.xlsx (mesma chave de EMPRESA). Faixas e maior custo vêm do valor "
+               "mensal contratado; clientes da base sem contrato aparecem como '(sem contrato)'.")
+
+elif aba == "Tendência":
+    # -----------------------------
+    # TENDÊNCIA (todos os meses de uma vez, a partir do cubo)
+    # -----------------------------
+    base_trend = st.radio("Base", ["Cliente selecionado", "Consolidado"], index=0, horizontal=True)
+    with timer.stage("aggregate"):
+        serie = cube.consolidated if base_trend == "Consolidado" else cube.client_series(cliente_sel)
+        trend = dre_trend(serie)
+    st.subheader("Tendência – Consolidado" if base_trend == "Consolidado" else f"Tendência – {cliente_sel}")
+
+    labels_trend = [month_label(p) if schema.has_mes_ref else str(p) for p in trend.index]
+
+    c1, c2 = st.columns([1,1])
+    with c1:
+        st.markdown("### Margem de Contribuição (%)")
+        st.line_chart(trend[["MC%", "MC% 3M", "MC% 12M"]])
+    with c2:
+        st.markdown("### Faturamento, CSP e MC (R$)")
+        st.line_chart(trend[["FAT BRUTO", "CSP", "MC"]])
+
+    # Linhas da DRE nas linhas, meses nas colunas
+    trend_show = pd.DataFrame(index=labels_trend)
+    for c in trend.columns:
+        fmt = perc_series if "%" in c else money_series
+        trend_show[c] = fmt(trend[c]).where(trend[c].notna(), "—").to_numpy()
+    st.markdown("### DRE mês a mês")
+    st.dataframe(trend_show.T, width="stretch")
+    st.caption("Δ = variação contra o mês anterior. YTD = acumulado no ano. MC% 3M/12M = MC ÷ FAT BRUTO somados nos últimos 3/12 meses.")
+
+# -----------------------------
+# Diagnóstico de desempenho
+# -----------------------------
+perf = timer.record(visao=aba, periodo=str(label_sel), cliente=str(cliente_sel),
+                    linhas=backend.row_count() if USE_SQL else len(df), backend="duckdb" if USE_SQL else "pandas",
+                    arquivos=len(data_files), memoria_base=data_memory, aquecimento=warm.status())
+if profiler is not None:
+    st.session_state.pop("perf_profiler", None)
+    prof_path = Path(CACHE_DIR_NAME) / "perf" / f"profile-{time.strftime('%Y%m%d-%H%M%S')}.prof"
+    st.session_state["perf_profile_text"] = finish_profile(profiler, prof_path)
+    perf["profile"] = str(prof_path)
+
+with st.sidebar.expander("Diagnóstico de desempenho", expanded=False):
+    st.caption(f"Execução: **{perf['total_s']:.3f}s** ({perf['linhas']} linhas)  \n"
+               + ("Base: **DuckDB sobre o cache Parquet** (fora da memória)  \n" if USE_SQL else
+                  f"Base em memória: **{data_memory['depois'] / 2**20:.1f} MB** "
+                  f"(antes da compactação: {data_memory['antes'] / 2**20:.1f} MB)  \n")
+               + "Pré-cálculo: " + ", ".join(f"{k} {v}" for k, v in perf["aquecimento"].items()))
+    st.dataframe(
+        pd.DataFrame({"s": perf["stages"]}).assign(**{"%": lambda t: t["s"] / max(perf["total_s"], 1e-9) * 100}).round(4),
+        width="stretch",
+    )
+    st.markdown("**Caches**  \n" + "  \n".join(
+        f"- {name}: {v if isinstance(v, str) else ', '.join(f'{k}={x}' for k, x in v.items())}"
+        for name, v in perf["caches"].items()
+    ))
+    log_on = st.checkbox(f"Gravar tempos em {PERF_LOG_PATH}", value=bool(os.environ.get("DRE_PERF_LOG")), key="perf_log")
+    if st.button("Perfilar a próxima execução (cProfile)"):
+        st.session_state["perf_profile_next"] = True
+        st.caption("A próxima interação será perfilada.")
+    if "perf_profile_text" in st.session_state:
+        st.code(st.session_state["perf_profile_text"], language=None)
+
+if log_on:
+    append_log(PERF_LOG_PATH, perf)
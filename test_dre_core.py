@@ -0,0 +1,91 @@
+"""
+Testes da camada de cálculo:
+
+- formatação pt-BR em lote: `money_series`/`perc_series` idênticos a
+  `money`/`perc` elemento a elemento, no caminho escalar (séries curtas) e
+  na matriz de bytes (séries longas);
+- atualização incremental: o mesmo resultado, índice incluído, que
+  recalcular a base inteira.
+
+    python -m pytest -q
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from dre_core import (_FORMAT_VECTOR_MIN, build_dre_cube, compact_bd, group_lines, money, money_series, perc,
+                      perc_series, resolve_real_cols, resolve_schema, update_dre_cube, update_real_lines)
+
+EDGE = [0.0, -0.0, 0.005, 0.015, 1.005, 2.675, -2.675, 1234.565, 999.995, 999999.995, 0.1 + 0.2, 1e15 + 0.5,
+        1e17, -1e18, 123456789.125, np.nan, np.inf, -np.inf, 7, -7]
+
+def _cases(n: int) -> pd.Series:
+    rng = np.random.default_rng(0)
+    noise = np.concatenate([rng.normal(0, 1e5, n), rng.integers(-10**9, 10**9, n) / 1000])
+    return pd.Series(np.resize(np.concatenate([EDGE, noise]), n))
+
+def _expected(fn, values) -> list:
+    return [fn(x) for x in values]
+
+@pytest.mark.parametrize("n", [5, _FORMAT_VECTOR_MIN - 1, _FORMAT_VECTOR_MIN, 5000])
+@pytest.mark.parametrize("series, scalar", [(money_series, money), (perc_series, perc)])
+def test_float_matches_scalar(n, series, scalar):
+    values = _cases(n)
+    assert series(values).tolist() == _expected(scalar, values)
+
+@pytest.mark.parametrize("n", [5, 5000])
+@pytest.mark.parametrize("series, scalar", [(money_series, money), (perc_series, perc)])
+def test_mixed_and_nullable_match_scalar(n, series, scalar):
+    mixed = pd.Series(np.resize(np.array([1.5, None, "abc", "12.5", pd.NA, float("nan"), 3], dtype=object), n))
+    assert series(mixed).tolist() == _expected(scalar, mixed)
+    nullable = pd.Series(np.resize([1.25, None, -3.0], n), dtype="Float64")
+    assert series(nullable).tolist() == _expected(scalar, nullable)
+
+def test_keeps_index():
+    values = pd.Series([1.0, 2.0], index=["a", "b"])
+    assert money_series(values).index.tolist() == ["a", "b"]
+    long = pd.Series(np.arange(1000.0), index=np.arange(1000) * 2)
+    assert perc_series(long).index.equals(long.index)
+
+# -----------------------------
+# Atualização incremental
+# -----------------------------
+def _raw_bd(rows: int = 600, clients: int = 12) -> pd.DataFrame:
+    rng = np.random.default_rng(1)
+    meses = pd.period_range("2025-01", periods=4, freq="M").to_timestamp(how="end").normalize()
+    df = pd.DataFrame({
+        "EMPRESA": rng.choice([f"CLIENTE {i:02d}" for i in range(clients)], rows),
+        "MÊS REF": meses[rng.integers(0, len(meses), rows)],
+        "FAT MÊS $": rng.integers(0, 10**7, rows) / 100,
+        "DEDUÇÕES LEGAIS": rng.integers(0, 10**6, rows) / 100,
+        "SALÁRIO": rng.integers(0, 10**6, rows) / 100,
+        "RATEIO MP": rng.normal(1000, 300, rows),  # frações de centavo: fica em float
+    })
+    # Um cliente fora do último mês (não pode aparecer nele) e um que só existe nele
+    df = df[~((df["EMPRESA"] == "CLIENTE 00") & (df["MÊS REF"] == meses[-1]))]
+    df.loc[df.index[-1], ["EMPRESA", "MÊS REF"]] = ["CLIENTE NOVO", meses[-1]]
+    return df.reset_index(drop=True)
+
+def test_cube_has_only_observed_clients():
+    df = compact_bd(_raw_bd())
+    cube = build_dre_cube(df, resolve_schema(df))
+    assert len(cube.by_client) == df.groupby(["MÊS REF", "EMPRESA"], observed=True).ngroups
+    assert "CLIENTE 00" not in cube.period_slice(df["MÊS REF"].max()).index
+
+def test_incremental_matches_full_rebuild():
+    raw = _raw_bd()
+    changed = raw["MÊS REF"].max()
+    # Versão anterior lida e compactada à parte, como no app: outras categorias de EMPRESA
+    df = compact_bd(raw)
+    old = compact_bd(raw[raw["MÊS REF"] != changed].reset_index(drop=True))
+    schema = resolve_schema(df)
+
+    full = build_dre_cube(df, schema)
+    updated = update_dre_cube(build_dre_cube(old, schema), df, schema, [changed])
+    pd.testing.assert_frame_equal(updated.by_client, full.by_client)
+    pd.testing.assert_frame_equal(updated.consolidated, full.consolidated)
+
+    real_cols = resolve_real_cols(df)
+    real_full, _ = group_lines(df, schema, *real_cols)
+    real_old, _ = group_lines(old, schema, *real_cols)
+    pd.testing.assert_frame_equal(update_real_lines(real_old, df, schema, [changed]), real_full)